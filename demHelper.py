@@ -0,0 +1,405 @@
+import re
+import zlib
+import struct
+from os import listdir
+from os.path import exists, getsize, join
+from typing import List, Union
+import numpy as np
+
+DEM_DIR = 'dem'
+DEM_EXTENSIONS = ('.hgt', '.tif', '.tiff')
+# tiles opened so far, by filename, so memory maps and decoded blocks are
+# reused between calls
+TILE_CACHE = {}
+HGT_PATTERN = re.compile(r'([NS])(\d{2})([EW])(\d{3})\.hgt$', re.IGNORECASE)
+HGT_NODATA = -32768
+
+TIFF_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 6: 'b',
+              7: 'B', 8: 'h', 9: 'i', 11: 'f', 12: 'd', 16: 'Q'}
+TIFF_DTYPES = {(1, 8): 'u1', (2, 8): 'i1', (1, 16): 'u2', (2, 16): 'i2',
+               (1, 32): 'u4', (2, 32): 'i4', (3, 32): 'f4', (3, 64): 'f8'}
+COMPRESSION_NONE = 1
+COMPRESSION_LZW = 5
+COMPRESSION_DEFLATE = (8, 32946)
+
+
+def read_tiff_tags(file, byte_order: str) -> dict:
+    """
+    Reads the tags of the first image in a TIFF file
+
+    #### Arguments:
+
+    - file - file object opened in binary mode
+    - byte_order - '<' or '>'
+
+    #### Returns:
+
+    - tags - dict {tag number: tuple of values, or bytes for text}
+    """
+    file.seek(4)
+    offset = struct.unpack(byte_order + 'I', file.read(4))[0]
+    file.seek(offset)
+    count = struct.unpack(byte_order + 'H', file.read(2))[0]
+    entries = file.read(12 * count)
+    tags = {}
+    for i in range(count):
+        tag, kind, length, value = struct.unpack(
+            byte_order + 'HHI4s', entries[12 * i:12 * i + 12])
+        if kind not in TIFF_TYPES:
+            continue
+        size = struct.calcsize(TIFF_TYPES[kind]) * length
+        if size > 4:
+            file.seek(struct.unpack(byte_order + 'I', value)[0])
+            value = file.read(size)
+        if kind == 2:
+            tags[tag] = value[:length].rstrip(b'\x00')
+        else:
+            tags[tag] = struct.unpack('{}{}{}'.format(
+                byte_order, length, TIFF_TYPES[kind]), value[:size])
+    return tags
+
+
+def open_geotiff(filename: str) -> dict:
+    """
+    Reads the layout and location of a single band, geographic (lat/lon)
+    GeoTIFF. The elevations are read later, one block at a time.
+
+    #### Arguments:
+
+    - filename - path of the GeoTIFF
+
+    #### Returns:
+
+    - tile - dict created by make_tile
+    - None if the file is not a GeoTIFF that can be read
+    """
+    with open(filename, 'rb') as file:
+        header = file.read(4)
+        if header not in (b'II*\x00', b'MM\x00*'):
+            print('{} is not a TIFF file (BigTIFF is not supported)'.format(filename))
+            return None
+        byte_order = '<' if header[:2] == b'II' else '>'
+        tags = read_tiff_tags(file, byte_order)
+    width, height = tags[256][0], tags[257][0]
+    compression = tags.get(259, (1,))[0]
+    sample_format = tags.get(339, (1,))[0]
+    bits = tags.get(258, (1,))[0]
+    if tags.get(277, (1,))[0] != 1 or (sample_format, bits) not in TIFF_DTYPES:
+        print('{} must have one band of integer or float elevations'.format(filename))
+        return None
+    if compression not in (COMPRESSION_NONE, COMPRESSION_LZW) + COMPRESSION_DEFLATE:
+        print('{} uses an unsupported compression ({}), convert it with '
+              'gdal_translate -co COMPRESS=DEFLATE'.format(filename, compression))
+        return None
+    if 33550 not in tags or 33922 not in tags:
+        print('{} has no georeferencing'.format(filename))
+        return None
+    geo_keys = tags.get(34735, ())
+    geo_keys = {geo_keys[i]: geo_keys[i + 3]
+                for i in range(4, len(geo_keys) - 3, 4)}
+    # 1024 = GTModelTypeGeoKey, 2 = geographic lat/lon
+    if geo_keys.get(1024, 2) != 2:
+        print('{} must use latitude and longitude coordinates'.format(filename))
+        return None
+    if 322 in tags:
+        block_width, block_height = tags[322][0], tags[323][0]
+        offsets, counts = tags[324], tags[325]
+    else:
+        block_width, block_height = width, tags.get(278, (height,))[0]
+        offsets, counts = tags[273], tags[279]
+    dtype = np.dtype(byte_order + TIFF_DTYPES[(sample_format, bits)])
+    if compression == COMPRESSION_NONE and 322 not in tags:
+        # uncompressed strips are normally stored one after the other, so the
+        # whole image can be mapped as a single block
+        row_size = width * dtype.itemsize
+        contiguous = all(offset == offsets[0] + i * block_height * row_size
+                         for i, offset in enumerate(offsets))
+        if contiguous:
+            block_width, block_height = width, height
+            offsets, counts = offsets[:1], (height * row_size,)
+    scale_x, scale_y = tags[33550][:2]
+    raster_x, raster_y, _, west, north = tags[33922][:5]
+    # 1025 = GTRasterTypeGeoKey, 2 = the tie point is the center of a pixel
+    if geo_keys.get(1025, 1) != 2:
+        west += scale_x / 2
+        north -= scale_y / 2
+    west -= raster_x * scale_x
+    north += raster_y * scale_y
+    nodata = tags.get(42113)
+    nodata = float(nodata) if nodata else None
+    return make_tile(filename, width, height, north, west, scale_y, scale_x, nodata, {
+        'dtype': dtype,
+        'compression': compression,
+        'predictor': tags.get(317, (1,))[0],
+        'block_width': block_width,
+        'block_height': block_height,
+        'offsets': offsets,
+        'counts': counts
+    })
+
+
+def open_hgt(filename: str) -> dict:
+    """
+    Reads the location of an SRTM .hgt tile from its name (ex: N43W073.hgt is
+    the square degree north and east of 43N 73W)
+
+    #### Arguments:
+
+    - filename - path of the .hgt file
+
+    #### Returns:
+
+    - tile - dict created by make_tile
+    - None if the name or size is not one of an SRTM tile
+    """
+    match = HGT_PATTERN.search(filename)
+    size = int(round((getsize(filename) / 2) ** .5))
+    if match is None or size * size * 2 != getsize(filename):
+        print('{} is not an SRTM tile'.format(filename))
+        return None
+    lat = int(match.group(2)) * (1 if match.group(1).upper() == 'N' else -1)
+    lon = int(match.group(4)) * (1 if match.group(3).upper() == 'E' else -1)
+    step = 1 / (size - 1)
+    return make_tile(filename, size, size, lat + 1, lon, step, step, HGT_NODATA, {
+        'dtype': np.dtype('>i2'),
+        'compression': COMPRESSION_NONE,
+        'predictor': 1,
+        'block_width': size,
+        'block_height': size,
+        'offsets': (0,),
+        'counts': (size * size * 2,)
+    })
+
+
+def make_tile(filename: str, width: int, height: int, north: float, west: float, lat_step: float, lon_step: float, nodata: Union[float, None], layout: dict) -> dict:
+    """
+    Creates the dict describing one elevation raster
+
+    #### Arguments:
+
+    - filename - path of the raster
+    - width, height - size of the raster in pixels
+    - north, west - location of the center of the top left pixel
+    - lat_step, lon_step - size of a pixel in degrees
+    - nodata - value used for missing elevations (None if there is none)
+    - layout - dict(dtype, compression, predictor, block_width, block_height,
+    offsets, counts) describing how the pixels are stored
+
+    #### Returns:
+
+    - tile - dict with the arguments as keys, the bounds of the raster, and
+    'blocks', a dict of the blocks read so far
+    """
+    tile = {
+        'filename': filename,
+        'width': width,
+        'height': height,
+        'north': north,
+        'west': west,
+        'south': north - (height - 1) * lat_step,
+        'east': west + (width - 1) * lon_step,
+        'lat_step': lat_step,
+        'lon_step': lon_step,
+        'nodata': nodata,
+        'blocks': {}
+    }
+    tile.update(layout)
+    tile['blocks_across'] = -(-width // tile['block_width'])
+    return tile
+
+
+def decode_lzw(data: bytes) -> bytes:
+    """
+    Decompresses TIFF LZW data
+
+    #### Arguments:
+
+    - data - compressed bytes
+
+    #### Returns:
+
+    - decompressed bytes
+    """
+    data = data + b'\x00\x00\x00'
+    total_bits = (len(data) - 3) * 8
+    base_table = [bytes([i]) for i in range(256)] + [b'', b'']
+    table = list(base_table)
+    output = bytearray()
+    position = 0
+    code_length = 9
+    previous = None
+    while position + code_length <= total_bits:
+        byte = position >> 3
+        bits = (data[byte] << 16) | (data[byte + 1] << 8) | data[byte + 2]
+        code = (bits >> (24 - (position & 7) - code_length)) & \
+            ((1 << code_length) - 1)
+        position += code_length
+        if code == 257:
+            break
+        if code == 256:
+            table = list(base_table)
+            code_length = 9
+            previous = None
+            continue
+        if code < len(table):
+            entry = table[code]
+            if previous is not None:
+                table.append(previous + entry[:1])
+        else:
+            entry = previous + previous[:1]
+            table.append(entry)
+        output += entry
+        previous = entry
+        # TIFF switches to longer codes one code early
+        if len(table) + 1 >= 1 << code_length and code_length < 12:
+            code_length += 1
+    return bytes(output)
+
+
+def read_block(tile: dict, index: int) -> np.ndarray:
+    """
+    Returns one block of a raster, memory mapping it if it is not
+    compressed. Blocks are kept in the tile so they are read only once.
+
+    #### Arguments:
+
+    - tile - dict created by make_tile
+    - index - block number, counting across and then down
+
+    #### Returns:
+
+    - block - 2d array of elevations
+    """
+    if index in tile['blocks']:
+        return tile['blocks'][index]
+    dtype = tile['dtype']
+    width = tile['block_width']
+    rows = tile['block_height']
+    if tile['block_width'] == tile['width']:
+        # strips are not padded at the bottom of the image
+        rows = min(rows, tile['height'] - (index * rows))
+    if tile['compression'] == COMPRESSION_NONE:
+        block = np.memmap(tile['filename'], dtype=dtype, mode='r',
+                          offset=tile['offsets'][index], shape=(rows, width))
+    else:
+        with open(tile['filename'], 'rb') as file:
+            file.seek(tile['offsets'][index])
+            data = file.read(tile['counts'][index])
+        if tile['compression'] == COMPRESSION_LZW:
+            data = decode_lzw(data)
+        else:
+            data = zlib.decompress(data)
+        if tile['predictor'] == 3:
+            # floating point predictor: each row holds the bytes of every
+            # value by significance, stored as differences
+            raw = np.frombuffer(data, dtype=np.uint8)[:rows * width * dtype.itemsize]
+            raw = np.cumsum(raw.reshape(rows, -1), axis=1, dtype=np.uint8)
+            raw = raw.reshape(rows, dtype.itemsize, width).transpose(0, 2, 1)
+            block = np.ascontiguousarray(raw).view(
+                dtype.newbyteorder('>')).reshape(rows, width)
+        else:
+            block = np.frombuffer(data, dtype=dtype)[
+                :rows * width].reshape(rows, width)
+            if tile['predictor'] == 2:
+                block = np.cumsum(block, axis=1, dtype=dtype)
+    tile['blocks'][index] = block
+    return block
+
+
+def read_pixels(tile: dict, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """
+    Reads the elevation of pixels of a raster
+
+    #### Arguments:
+
+    - tile - dict created by make_tile
+    - rows - array of pixel rows
+    - cols - array of pixel columns
+
+    #### Returns:
+
+    - elevation - array of elevations (NaN where the raster has no data)
+    """
+    block_rows = rows // tile['block_height']
+    block_cols = cols // tile['block_width']
+    blocks = block_rows * tile['blocks_across'] + block_cols
+    elevation = np.empty(len(rows))
+    for index in np.unique(blocks):
+        in_block = blocks == index
+        block = read_block(tile, index)
+        elevation[in_block] = block[rows[in_block] - block_rows[in_block] * tile['block_height'],
+                                    cols[in_block] - block_cols[in_block] * tile['block_width']]
+    if tile['nodata'] is not None:
+        elevation[elevation == tile['nodata']] = np.nan
+    return elevation
+
+
+def open_dem_tiles(directory: str = DEM_DIR) -> List[dict]:
+    """
+    Opens every elevation raster in a directory
+
+    #### Arguments:
+
+    - directory - folder holding .hgt and GeoTIFF files (default = 'dem')
+
+    #### Returns:
+
+    - tiles - list of dicts created by make_tile
+    """
+    tiles = []
+    if not exists(directory):
+        return tiles
+    for name in sorted(listdir(directory)):
+        if not name.lower().endswith(DEM_EXTENSIONS):
+            continue
+        filename = join(directory, name)
+        if filename not in TILE_CACHE:
+            if name.lower().endswith('.hgt'):
+                TILE_CACHE[filename] = open_hgt(filename)
+            else:
+                TILE_CACHE[filename] = open_geotiff(filename)
+        if TILE_CACHE[filename] is not None:
+            tiles.append(TILE_CACHE[filename])
+    return tiles
+
+
+def sample_dem(tiles: List[dict], lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Finds the elevation of many points at once by bilinear interpolation
+    between the four nearest pixels. Each point uses the first tile that
+    covers it.
+
+    #### Arguments:
+
+    - tiles - list of dicts created by make_tile
+    - lat - array of latitudes
+    - lon - array of longitudes
+
+    #### Returns:
+
+    - elevation - array of elevations in meters (NaN for points outside the
+    tiles or next to missing data)
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    elevation = np.full(len(lat), np.nan)
+    remaining = np.ones(len(lat), dtype=bool)
+    for tile in tiles:
+        inside = remaining & (lat <= tile['north']) & (lat >= tile['south']) & \
+            (lon >= tile['west']) & (lon <= tile['east'])
+        if not inside.any():
+            continue
+        row = (tile['north'] - lat[inside]) / tile['lat_step']
+        col = (lon[inside] - tile['west']) / tile['lon_step']
+        top = np.clip(np.floor(row).astype(np.int64), 0, tile['height'] - 2)
+        left = np.clip(np.floor(col).astype(np.int64), 0, tile['width'] - 2)
+        down = row - top
+        right = col - left
+        upper = read_pixels(tile, top, left) * (1 - right) + \
+            read_pixels(tile, top, left + 1) * right
+        lower = read_pixels(tile, top + 1, left) * (1 - right) + \
+            read_pixels(tile, top + 1, left + 1) * right
+        elevation[inside] = upper * (1 - down) + lower * down
+        # points next to missing data can still be found in a later tile
+        remaining &= ~inside | np.isnan(elevation)
+    return elevation
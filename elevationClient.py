@@ -0,0 +1,240 @@
+import asyncio
+import json
+import time
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from typing import Callable, List, Tuple, Union
+from urllib.parse import urlsplit
+
+API_URL = 'https://api.opentopodata.org/v1/ned10m'
+# API_URL = 'https://api.opentopodata.org/v1/mapzen'
+# the public Open Topo Data API allows 100 locations per request and one
+# request per second
+BATCH_SIZE = 100
+REQUESTS_PER_SECOND = 1
+CONCURRENCY = 1
+# failed requests with these status codes, or that could not connect, are
+# sent again after RETRY_DELAY seconds, doubling after each attempt
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+RETRY_LIMIT = 5
+RETRY_DELAY = 2
+
+
+def create_token_bucket(rate: float, capacity: float = 1) -> dict:
+    """
+    Creates a token bucket rate limiter. Tokens are added at a fixed rate up
+    to the capacity, and each request takes one.
+
+    #### Arguments:
+
+    - rate - tokens added per second
+    - capacity - most tokens that can be saved up (default = 1)
+
+    #### Returns:
+
+    - bucket - dict(rate, capacity, tokens, updated)
+    """
+    return {'rate': rate, 'capacity': capacity, 'tokens': capacity,
+            'updated': time.monotonic()}
+
+
+# shared by every request the program makes, so the limit holds across
+# trails, lifts and mountains
+API_LIMIT = create_token_bucket(REQUESTS_PER_SECOND)
+# idle keep-alive connections, by (scheme, host)
+CONNECTION_POOL = {}
+
+
+async def acquire_token(bucket: dict) -> None:
+    """
+    Waits until a request is allowed by a token bucket. The token is taken
+    right away, so callers waiting at the same time are spaced out in the
+    order they arrived.
+
+    #### Arguments:
+
+    - bucket - dict created by create_token_bucket
+
+    #### Returns:
+
+    - Void
+    """
+    now = time.monotonic()
+    bucket['tokens'] = min(bucket['capacity'], bucket['tokens'] +
+                           (now - bucket['updated']) * bucket['rate'])
+    bucket['updated'] = now
+    bucket['tokens'] -= 1
+    if bucket['tokens'] < 0:
+        await asyncio.sleep(-bucket['tokens'] / bucket['rate'])
+
+
+def open_connection(url: str) -> Union[HTTPConnection, HTTPSConnection]:
+    """
+    Opens a connection to the host of a url
+
+    #### Arguments:
+
+    - url - url of the elevation API
+
+    #### Returns:
+
+    - connection - http.client connection
+    """
+    parts = urlsplit(url)
+    if parts.scheme == 'https':
+        return HTTPSConnection(parts.netloc, timeout=60)
+    return HTTPConnection(parts.netloc, timeout=60)
+
+
+def request_batch(url: str, coordinates: List[tuple]) -> Tuple[int, bytes]:
+    """
+    Sends one request for the elevation of up to BATCH_SIZE points, reusing
+    an idle connection from the pool when there is one. Blocks, so it is run
+    in a worker thread.
+
+    #### Arguments:
+
+    - url - url of the elevation API
+    - coordinates - list of coordinates (lat,lon)
+
+    #### Returns:
+
+    - (status code (int), response body (bytes))
+    """
+    parts = urlsplit(url)
+    path = '{}?locations={}'.format(parts.path, '|'.join(
+        '{},{}'.format(coordinate[0], coordinate[1]) for coordinate in coordinates))
+    idle = CONNECTION_POOL.setdefault((parts.scheme, parts.netloc), [])
+    try:
+        connection = idle.pop()
+        reused = True
+    except IndexError:
+        connection = open_connection(url)
+        reused = False
+    try:
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+        except ConnectionError:
+            # the server may have closed an idle connection
+            if not reused:
+                raise
+            connection.close()
+            connection = open_connection(url)
+            connection.request('GET', path)
+            response = connection.getresponse()
+        body = response.read()
+    except (OSError, HTTPException):
+        connection.close()
+        raise
+    idle.append(connection)
+    return (response.status, body)
+
+
+async def fetch_batches(batches: List[List[tuple]], trail_name: str, url: str, concurrency: int, bucket: dict, save_batch: Union[Callable, None] = None) -> Union[Tuple[list, int], int]:
+    """
+    Requests every batch, with up to concurrency requests in flight at once.
+    Transient errors are retried with exponential backoff.
+
+    #### Arguments:
+
+    - batches - list of lists of coordinates (lat,lon)
+    - trail_name - name of current trail. Used for error messages
+    - url - url of the elevation API
+    - concurrency - most requests in flight at once
+    - bucket - dict created by create_token_bucket
+    - save_batch - function called with the batch index and its elevations as
+    soon as each batch arrives (default = None)
+
+    #### Returns:
+
+    - (results (list of elevation lists, one for each batch), api_requests (int))
+    - -1 if error
+    """
+    results = [None] * len(batches)
+    pending = list(range(len(batches)))
+    failed = []
+    api_requests = []
+
+    async def worker():
+        while pending and not failed:
+            i = pending.pop(0)
+            for attempt in range(RETRY_LIMIT + 1):
+                await acquire_token(bucket)
+                api_requests.append(i)
+                try:
+                    status, body = await asyncio.to_thread(
+                        request_batch, url, batches[i])
+                except (OSError, HTTPException) as error:
+                    status, body = None, error
+                if status == 200:
+                    break
+                if status is None:
+                    print('Elevation API call failed on {}:'.format(trail_name))
+                else:
+                    print('Elevation API call failed on {} with code:'.format(trail_name))
+                    print(status)
+                print(body)
+                if (status is not None and status not in TRANSIENT_STATUS) or attempt == RETRY_LIMIT:
+                    failed.append(i)
+                    return
+                delay = RETRY_DELAY * 2 ** attempt
+                print('Retrying in {} seconds'.format(delay))
+                await asyncio.sleep(delay)
+            # a 200 response that cannot be read is treated as a failed request
+            try:
+                elevations = [result['elevation']
+                              for result in json.loads(body)['results']]
+            except (ValueError, KeyError, TypeError):
+                elevations = None
+            if elevations is None or len(elevations) != len(batches[i]):
+                print('Elevation API call on {} returned an unreadable response:'.format(
+                    trail_name))
+                print(body)
+                failed.append(i)
+                return
+            results[i] = elevations
+            if save_batch is not None:
+                save_batch(i, results[i])
+
+    await asyncio.gather(*[worker() for _ in range(min(concurrency, len(batches)))])
+    if failed:
+        return -1
+    return (results, len(api_requests))
+
+
+def fetch_elevations(coordinates: List[tuple], trail_name: str = '', url: str = API_URL, concurrency: int = CONCURRENCY, bucket: dict = API_LIMIT, save_batch: Union[Callable, None] = None):
+    """
+    Fetches the elevation of each point from an Open Topo Data compatible
+    API, in requests of BATCH_SIZE points
+
+    #### Arguments:
+
+    - coordinates - list of coordinates (lat,lon)
+    - trail_name - name of current trail. Used for error messages (default = '')
+    - url - url of the elevation API (default = API_URL)
+    - concurrency - most requests in flight at once, for providers that
+    allow more than one (default = CONCURRENCY)
+    - bucket - rate limiter from create_token_bucket (default = API_LIMIT,
+    shared by every call)
+    - save_batch - function called with the position of the first point of
+    each request in coordinates, and its elevations, as soon as it arrives,
+    so they are kept even if a later request fails (default = None)
+
+    #### Returns:
+
+    - tuple(elevations (list), api_requests (int))
+    - -1 if error
+    """
+    batches = [coordinates[i:i + BATCH_SIZE]
+               for i in range(0, len(coordinates), BATCH_SIZE)]
+    if len(batches) == 0:
+        return ([], 0)
+
+    def save(i, elevations):
+        save_batch(i * BATCH_SIZE, elevations)
+
+    result = asyncio.run(fetch_batches(
+        batches, trail_name, url, concurrency, bucket, None if save_batch is None else save))
+    if result == -1:
+        return -1
+    return ([elevation for batch in result[0] for elevation in batch], result[1])
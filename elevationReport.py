@@ -0,0 +1,259 @@
+import numpy as np
+import pandas as pd
+from os import listdir
+from os.path import exists
+from typing import List
+
+import helper
+import loadData
+import osmHelper
+
+
+def cached_mountains() -> List[str]:
+    """
+    Lists the mountains that have a trail point cache
+
+    #### Arguments:
+
+    - None
+
+    #### Returns:
+
+    - mountains - list of mountain names
+    """
+    if not exists('cached/trail_points'):
+        return []
+    return sorted(filename[:-4] for filename in listdir('cached/trail_points')
+                  if filename.endswith('.csv'))
+
+
+def load_rated_lines(mountain: str) -> List[pd.DataFrame]:
+    """
+    Reads the line each trail of a mountain is rated on from its trail point
+    cache: the centerline for areas, and the trail itself otherwise. Lines
+    with points cached without an elevation, such as approximate ones, are
+    left out.
+
+    #### Arguments:
+
+    - mountain - name of the mountain
+
+    #### Returns:
+
+    - lines - list of dataframe(lat, lon, coordinates, elevation)
+    """
+    df = loadData.load_point_cache(
+        'cached/trail_points/{}.csv'.format(mountain))
+    areas = set(df.trail_id[~df.for_display])
+    starts = np.append(np.flatnonzero(df['index'].to_numpy() == 0), len(df))
+    lat = df.lat_e8.to_numpy() / helper.COORDINATE_SCALE
+    lon = df.lon_e8.to_numpy() / helper.COORDINATE_SCALE
+    lines = []
+    for start, end in zip(starts[:-1], starts[1:]):
+        if df.for_display[start] and df.trail_id[start] in areas:
+            continue
+        if np.isnan(df.elevation.to_numpy()[start:end]).any():
+            continue
+        line = pd.DataFrame()
+        line['lat'] = lat[start:end]
+        line['lon'] = lon[start:end]
+        line['coordinates'] = list(zip(line.lat, line.lon))
+        line['elevation'] = df.elevation.to_numpy()[start:end]
+        lines.append(line)
+    return lines
+
+
+def compare_ratings(lines: List[pd.DataFrame], elevations: List[np.ndarray]) -> dict:
+    """
+    Compares the elevations and ratings of trails against the same trails
+    with other elevations
+
+    #### Arguments:
+
+    - lines - list of dataframes from load_rated_lines
+    - elevations - list of arrays of new elevations, one for each line
+
+    #### Returns:
+
+    - dict(trails (int), elevation_error (array of absolute errors in meters),
+    rating_change (array of absolute changes in degrees), color_changes (int))
+    """
+    helper.add_distances(lines)
+    changed = []
+    for line, elevation in zip(lines, elevations):
+        line = line.copy()
+        line['elevation'] = elevation
+        changed.append(line)
+    before = helper.add_trail_stats([line.copy() for line in lines], False)
+    after = helper.add_trail_stats(changed, False)
+    before = np.array([stats['rating'] for stats in before])
+    after = np.array([stats['rating'] for stats in after])
+    return {
+        'trails': len(lines),
+        'elevation_error': np.abs(np.concatenate([line.elevation.to_numpy(dtype=float) for line in lines]) -
+                                  np.concatenate(elevations)),
+        'rating_change': np.abs(after - before) * 100,
+        'color_changes': sum(helper.set_color(x) != helper.set_color(y)
+                             for x, y in zip(before, after))
+    }
+
+
+def print_comparison(name: str, comparison: dict, requests: int, new_requests: int) -> None:
+    """
+    Prints one line of an elevation report
+
+    #### Arguments:
+
+    - name - name of the row
+    - comparison - dict created by compare_ratings
+    - requests - API requests needed for every point
+    - new_requests - API requests needed by the new method
+
+    #### Returns:
+
+    - Void
+    """
+    error = comparison['elevation_error']
+    change = comparison['rating_change']
+    print('{:<24} {:>6} {:>8} {:>6} {:>7.2f} {:>7.2f} {:>7.2f} {:>7.2f} {:>7.2f} {:>5}'.format(
+        name[:24], comparison['trails'], requests, new_requests,
+        np.nanmean(error), np.nanpercentile(error, 95), np.nanmax(error),
+        np.nanmean(change), np.nanmax(change), comparison['color_changes']))
+
+
+def grid_report(mountains: List[str] = None, step: int = helper.GRID_STEP) -> None:
+    """
+    Measures the 'grid' elevation source against the cached elevations, which
+    were fetched for each point. Prints the API requests each needs, the
+    elevation error in meters, the change in trail ratings in degrees, and the
+    number of trails that change color. Trails with approximate elevations are
+    not cached in full, so they are left out. Grid corners that are not stored
+    are fetched from the API.
+
+    #### Arguments:
+
+    - mountains - names of mountains (default = every cached mountain)
+    - step - grid spacing in elevation data cells (default = helper.GRID_STEP)
+
+    #### Returns:
+
+    - Void
+    """
+    if mountains is None:
+        mountains = cached_mountains()
+    print('{:<24} {:>6} {:>8} {:>6} {:>7} {:>7} {:>7} {:>7} {:>7} {:>5}'.format(
+        'mountain', 'trails', 'requests', 'grid', 'mean m', 'p95 m', 'max m', 'mean °', 'max °', 'color'))
+    comparisons = []
+    total_requests = 0
+    total_grid_requests = 0
+    for mountain in mountains:
+        if not exists('cached/trail_points/{}.csv'.format(mountain)):
+            print('{} is not cached, run it first'.format(mountain))
+            continue
+        lines = load_rated_lines(mountain)
+        if len(lines) == 0:
+            continue
+        points = helper.coordinates_to_array(
+            [point for line in lines for point in line.coordinates])
+        size = helper.DEM_GRID * step
+        rows = np.floor(points[:, 0] / size)
+        cols = np.floor(points[:, 1] / size)
+        corners = np.unique(np.stack([np.concatenate([rows, rows, rows + 1, rows + 1]),
+                                      np.concatenate([cols, cols + 1, cols, cols + 1])], axis=1), axis=0)
+        requests = -(-len(np.unique(points, axis=0)) // 100)
+        grid_requests = -(-len(corners) // 100)
+        result = helper.grid_elevation(
+            [point for line in lines for point in line.coordinates], mountain, step)
+        if result == -1:
+            return
+        elevation = result[0].to_numpy()
+        offsets = np.cumsum([0] + [len(line) for line in lines])
+        comparison = compare_ratings(
+            lines, [elevation[offsets[i]:offsets[i + 1]] for i in range(len(lines))])
+        print_comparison(mountain, comparison, requests, grid_requests)
+        comparisons.append(comparison)
+        total_requests += requests
+        total_grid_requests += grid_requests
+    if len(comparisons) == 0:
+        print('No cached trails to compare')
+        return
+    print_comparison('all', {
+        'trails': sum(c['trails'] for c in comparisons),
+        'elevation_error': np.concatenate([c['elevation_error'] for c in comparisons]),
+        'rating_change': np.concatenate([c['rating_change'] for c in comparisons]),
+        'color_changes': sum(c['color_changes'] for c in comparisons)
+    }, total_requests, total_grid_requests)
+
+
+def sparse_report(spacing: int, mountains: List[str] = None) -> None:
+    """
+    Measures sampling trail elevations every spacing meters, and
+    interpolating the points between, against the cached elevations, which
+    were fetched for each point. Prints the API requests each needs, the
+    elevation error in meters, the change in trail ratings in degrees, and the
+    number of trails that change color. Areas, and trails with points that are
+    not cached or were cached without an elevation because it was
+    interpolated, are left out. Nothing is fetched from the API.
+
+    #### Arguments:
+
+    - spacing - most meters between sampled points
+    - mountains - names of mountains (default = every cached mountain)
+
+    #### Returns:
+
+    - Void
+    """
+    if mountains is None:
+        mountains = cached_mountains()
+    print('{:<24} {:>6} {:>8} {:>6} {:>7} {:>7} {:>7} {:>7} {:>7} {:>5}'.format(
+        'mountain', 'trails', 'requests', 'sparse', 'mean m', 'p95 m', 'max m', 'mean °', 'max °', 'color'))
+    comparisons = []
+    total_requests = 0
+    total_sparse_requests = 0
+    for mountain in mountains:
+        if not exists('cached/trail_points/{}.csv'.format(mountain)):
+            print('{} is not cached, run it first'.format(mountain))
+            continue
+        osm_filename = osmHelper.find_osm_file(mountain)
+        if osm_filename is None:
+            print('{} has no OSM file'.format(mountain))
+            continue
+        ele_dict = loadData.load_cached_elevations(
+            'cached/trail_points/{}.csv'.format(mountain))
+        parsed_osm = osmHelper.load_osm(osm_filename, set())
+        trail_ways = parsed_osm['trail_ways']
+        trail_nodes = [osmHelper.get_way_points(trail_ways, i, parsed_osm['nodes'])
+                       for i in range(parsed_osm['trail_count'])
+                       if not parsed_osm['attributes'][trail_ways['way_id'][i]]['is_area']]
+        lines = helper.fill_in_point_gaps_batch(trail_nodes, 15)
+        line_keys = helper.round_coordinates(lines)
+        samples = helper.fill_in_point_gaps_batch(trail_nodes, spacing)
+        sample_keys = helper.round_coordinates(samples)
+        kept = [i for i in range(len(lines))
+                if all(key in ele_dict for key in line_keys[i])]
+        if len(kept) == 0:
+            print('{} has no trails with every elevation fetched'.format(mountain))
+            continue
+        for i in kept:
+            lines[i]['elevation'] = [ele_dict[key] for key in line_keys[i]]
+            samples[i]['elevation'] = [ele_dict[key] for key in sample_keys[i]]
+        interpolated = helper.fill_in_point_gaps_batch(
+            [samples[i] for i in kept], 15, True)
+        requests = -(-len({key for i in kept for key in line_keys[i]}) // 100)
+        sparse_requests = -(-len({key for i in kept for key in sample_keys[i]}) // 100)
+        comparison = compare_ratings([lines[i] for i in kept],
+                                     [line['elevation'].to_numpy() for line in interpolated])
+        print_comparison(mountain, comparison, requests, sparse_requests)
+        comparisons.append(comparison)
+        total_requests += requests
+        total_sparse_requests += sparse_requests
+    if len(comparisons) == 0:
+        print('No cached trails to compare')
+        return
+    print_comparison('all', {
+        'trails': sum(c['trails'] for c in comparisons),
+        'elevation_error': np.concatenate([c['elevation_error'] for c in comparisons]),
+        'rating_change': np.concatenate([c['rating_change'] for c in comparisons]),
+        'color_changes': sum(c['color_changes'] for c in comparisons)
+    }, total_requests, total_sparse_requests)
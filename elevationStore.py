@@ -0,0 +1,189 @@
+import sqlite3
+from contextlib import closing
+from decimal import Decimal, ROUND_HALF_EVEN
+from os import listdir
+from os.path import exists
+from typing import Dict, Iterable, List, Tuple
+import pandas as pd
+
+STORE_FILE = 'cached/elevations.db'
+# rows sent to sqlite per statement
+BATCH_SIZE = 10000
+# elevations fetched before the store existed are copied in from these
+POINT_CACHE_DIRS = ['cached/trail_points', 'cached/lift_points']
+
+
+def open_store(filename: str = STORE_FILE) -> sqlite3.Connection:
+    """
+    Opens the elevation store, creating it if needed. Elevations are keyed by
+    coordinates as integers of 1e-8 degrees (as created by
+    helper.coordinate_keys), and are shared by every mountain. Until the
+    point caches have been imported once, they are imported on opening.
+
+    #### Arguments:
+
+    - filename - path of the sqlite database (default = 'cached/elevations.db')
+
+    #### Returns:
+
+    - connection - sqlite3 connection
+    """
+    connection = sqlite3.connect(filename)
+    connection.execute('''CREATE TABLE IF NOT EXISTS elevations (
+        lat INTEGER NOT NULL,
+        lon INTEGER NOT NULL,
+        elevation REAL NOT NULL,
+        PRIMARY KEY (lat, lon)
+    ) WITHOUT ROWID''')
+    connection.execute('''CREATE TABLE IF NOT EXISTS meta (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )''')
+    if connection.execute("SELECT value FROM meta WHERE name = 'point_caches_imported'").fetchone() is None:
+        import_point_caches(connection)
+    return connection
+
+
+def insert_elevations(connection: sqlite3.Connection, rows: List[tuple]) -> None:
+    """
+    Adds elevations to an open store in one transaction. Points that are
+    already stored keep their elevation.
+
+    #### Arguments:
+
+    - connection - sqlite3 connection created by open_store
+    - rows - list of (lat, lon, elevation) tuples
+
+    #### Returns:
+
+    - Void
+    """
+    with connection:
+        for start in range(0, len(rows), BATCH_SIZE):
+            connection.executemany('INSERT OR IGNORE INTO elevations VALUES (?, ?, ?)',
+                                   rows[start:start + BATCH_SIZE])
+
+
+def decimal_keys(values: Iterable[str]) -> List[int]:
+    """
+    Converts coordinates written as decimal text to integers of 1e-8
+    degrees, rounding halfway cases to even like helper.coordinate_keys
+
+    #### Arguments:
+
+    - values - coordinates as strings
+
+    #### Returns:
+
+    - keys - list of int
+    """
+    return [int(Decimal(value).scaleb(8).quantize(Decimal(1), ROUND_HALF_EVEN))
+            for value in values]
+
+
+def import_point_caches(connection: sqlite3.Connection) -> None:
+    """
+    Fills the store with the elevations in every trail and lift point cache,
+    so points that were fetched before the store existed are never fetched
+    again. The import is only marked as done once every cache has been read,
+    so one that is interrupted starts over the next time the store is opened,
+    skipping the points it already added.
+
+    #### Arguments:
+
+    - connection - sqlite3 connection created by open_store
+
+    #### Returns:
+
+    - Void
+    """
+    for directory in POINT_CACHE_DIRS:
+        if not exists(directory):
+            continue
+        for cache in sorted(listdir(directory)):
+            if not cache.endswith('.csv'):
+                continue
+            df = pd.read_csv('{}/{}'.format(directory, cache),
+                             dtype={'lat': str, 'lon': str})
+            if 'lat_e8' in df.columns:
+                lat = df.lat_e8.tolist()
+                lon = df.lon_e8.tolist()
+            else:
+                # caches from before coordinates were saved as integers
+                lat = decimal_keys(df.lat)
+                lon = decimal_keys(df.lon)
+            rows = [(lat_key, lon_key, elevation) for lat_key, lon_key, elevation
+                    in zip(lat, lon, df.elevation.tolist()) if elevation == elevation]
+            insert_elevations(connection, rows)
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('point_caches_imported', '1')")
+    print('{} elevations in the store after importing the point caches'.format(
+        connection.execute('SELECT COUNT(*) FROM elevations').fetchone()[0]))
+
+
+def lookup_elevations(keys: Iterable[Tuple[int, int]], filename: str = STORE_FILE) -> Dict[Tuple[int, int], float]:
+    """
+    Looks up the stored elevation of many points at once
+
+    #### Arguments:
+
+    - keys - (lat, lon) integer pairs
+    - filename - path of the sqlite database (default = 'cached/elevations.db')
+
+    #### Returns:
+
+    - elevations - dict {(lat, lon): elevation} for the points that are stored
+    """
+    keys = list(set(keys))
+    elevations = {}
+    if len(keys) == 0:
+        return elevations
+    with closing(open_store(filename)) as connection:
+        connection.execute(
+            'CREATE TEMP TABLE lookup (lat INTEGER, lon INTEGER)')
+        for start in range(0, len(keys), BATCH_SIZE):
+            connection.executemany('INSERT INTO lookup VALUES (?, ?)',
+                                   keys[start:start + BATCH_SIZE])
+        for lat, lon, elevation in connection.execute(
+                'SELECT lat, lon, elevation FROM lookup JOIN elevations USING (lat, lon)'):
+            elevations[(lat, lon)] = elevation
+    return elevations
+
+
+def save_elevations(elevations: Iterable[Tuple[Tuple[int, int], float]], filename: str = STORE_FILE) -> None:
+    """
+    Adds elevations to the store. Points that are already stored keep their
+    elevation, and missing elevations (None or NaN) are not stored.
+
+    #### Arguments:
+
+    - elevations - ((lat, lon), elevation) pairs, such as dict.items()
+    - filename - path of the sqlite database (default = 'cached/elevations.db')
+
+    #### Returns:
+
+    - Void
+    """
+    rows = [(key[0], key[1], elevation) for key, elevation in elevations
+            if elevation is not None and elevation == elevation]
+    if len(rows) == 0:
+        return
+    with closing(open_store(filename)) as connection:
+        insert_elevations(connection, rows)
+
+
+def count_elevations(filename: str = STORE_FILE) -> int:
+    """
+    Counts the points in the elevation store
+
+    #### Arguments:
+
+    - filename - path of the sqlite database (default = 'cached/elevations.db')
+
+    #### Returns:
+
+    - count - number of stored points
+    """
+    with closing(open_store(filename)) as connection:
+        return connection.execute('SELECT COUNT(*) FROM elevations').fetchone()[0]
@@ -1,13 +1,16 @@
-import time
-import json
 from typing import Tuple
 from typing import List
 from typing import Union
 import pandas as pd
+import numpy as np
 from numpy import NAN
-import haversine as hs
 from math import degrees, atan
-from requests.api import get
+from itertools import chain
+import requests
+
+import demHelper
+import elevationClient
+import elevationStore
 
 
 def osm_api(bounding_box: str):
@@ -28,7 +31,7 @@ def osm_api(bounding_box: str):
     """
     url = f'https://overpass-api.de/api/map?bbox={bounding_box}'
     print('\nFetching OSM file...')
-    response = get(url)
+    response = requests.get(url)
     if response.status_code == 200:
         return response.content
     else:
@@ -62,95 +65,156 @@ def create_osm_bounding_box(latitude: float, longitude: float, size: float = 1.0
     return f'{min_lon},{min_lat},{max_lon},{max_lat}'
 
 
-def elevation_api(piped_coords: str, last_called: float, trailname: str = '') -> Tuple[list, float]:
+# cell size of the ned10m elevation data (1/3 arc-second) in degrees
+DEM_GRID = 1 / 10800
+# the grid source fetches every GRID_STEP cells and interpolates between them
+GRID_STEP = 3
+
+
+def get_elevation(coordinates: Union[list, pd.Series], trail_name: str = '', source: str = 'api'):
     """
-    Helper function for get_elevation. Accepts piped_coords, timestamp, and
-    trailname and queries an elevation API to fetch elevation data at each
-    point.
+    Takes in coordinates, and optionally a trailname, and returns a series of
+    elevations (float)
 
     #### Arguments:
 
-    - piped_coords - string of coords separated by a |
-    - last_called - time.time object for last time the API was requested
-    - trailname - name of current trail
+    - coordinates - list of coordinates (lat,lon)
+    - trail_name - name of current trail. Used for error messages (default = '')
+    - source - 'api' to query the elevation API, 'dem' to read the elevation
+    rasters in the dem directory, using the API only for points they do not
+    cover, or 'grid' to query the API on a grid and interpolate between it
+    (see grid_elevation) (default = 'api')
 
     #### Returns:
 
-    - (elevation (list), last_called (time.time()))
+    - tuple(elevations (series), api_requests (int))
+    - -1 if error
     """
-    url = 'https://api.opentopodata.org/v1/ned10m?locations={}'
-    # url = 'https://api.opentopodata.org/v1/mapzen?locations={}'
-    if time.time() - last_called < 1:
-        time.sleep(1 - (time.time() - last_called))
-    last_called = time.time()
-    response = get(url.format(piped_coords))
-    if response.status_code == 200:
-        elevation = []
-        for result in json.loads(response.content)['results']:
-            elevation.append(result['elevation'])
-    else:
-        print('Elevation API call failed on {} with code:'.format(trailname))
-        print(response.status_code)
-        print(response.content)
+    if source == 'dem':
+        coordinates = list(coordinates)
+        points = coordinates_to_array(coordinates)
+        elevations = demHelper.sample_dem(
+            demHelper.open_dem_tiles(), points[:, 0], points[:, 1])
+        missing = np.flatnonzero(np.isnan(elevations))
+        api_requests = 0
+        if len(missing) > 0:
+            print('{} points on {} are outside the DEM tiles'.format(
+                len(missing), trail_name))
+            result = get_elevation([coordinates[i] for i in missing], trail_name)
+            if result == -1:
+                return -1
+            elevations[missing] = result[0]
+            api_requests = result[1]
+        return (pd.Series(elevations), api_requests)
+
+    if source == 'grid':
+        return grid_elevation(coordinates, trail_name)
+
+    # elevations already in the store are not fetched again, and each
+    # location that is missing is only requested once
+    coordinates = list(coordinates)
+    points = coordinates_to_array(coordinates)
+    keys = list(zip(coordinate_keys(points[:, 0]).tolist(),
+                    coordinate_keys(points[:, 1]).tolist()))
+    stored = elevationStore.lookup_elevations(keys)
+    missing = {}
+    for key, coordinate in zip(keys, coordinates):
+        if key not in stored and key not in missing:
+            missing[key] = coordinate
+
+    # each response is saved to the store as soon as it arrives, so a run
+    # that fails or is stopped part way resumes where it left off
+    missing_keys = list(missing)
+
+    def save_batch(start, elevations):
+        elevationStore.save_elevations(
+            zip(missing_keys[start:start + len(elevations)], elevations))
+
+    result = elevationClient.fetch_elevations(
+        list(missing.values()), trail_name, save_batch=save_batch)
+    if result == -1:
         return -1
-    return (elevation, last_called)
+    stored.update(zip(missing, result[0]))
+    return (pd.Series([stored.get(key) for key in keys], dtype=float), result[1])
 
 
-def get_elevation(coordinates: Union[list, pd.Series], last_called: Union[float, None] = None, trail_name: str = '', api_requests: int = 0):
+def grid_elevation(coordinates: Union[list, pd.Series], trail_name: str = '', step: int = GRID_STEP):
     """
-    Takes in coordinates, and optionally a timestamp, trailname, and previous API requests count
-    and returns a series of elevations (float)
+    Snaps each point to the corners of its cell in a grid of step elevation
+    data cells, fetches each corner once from the API, and interpolates the
+    elevation of the point between its four corners. Nearby trails and
+    densified points share corners, so fewer locations are requested.
 
     #### Arguments:
 
     - coordinates - list of coordinates (lat,lon)
-    - last called - time.time object for last API call time (default = current time)
     - trail_name - name of current trail. Used for error messages (default = '')
-    - api_requests - number of API requests made by the program (default = 0)
+    - step - grid spacing in elevation data cells (default = GRID_STEP)
 
     #### Returns:
 
-    - tuple(elevations (series), api_requests (int), last_called (time))
+    - tuple(elevations (series), api_requests (int))
     - -1 if error
     """
+    points = coordinates_to_array(list(coordinates))
+    size = DEM_GRID * step
+    row = points[:, 0] / size
+    col = points[:, 1] / size
+    row_floor = np.floor(row)
+    col_floor = np.floor(col)
+    row_fraction = row - row_floor
+    col_fraction = col - col_floor
+    # corners in the order (0, 0), (0, 1), (1, 0), (1, 1)
+    corners = np.stack([np.concatenate([row_floor, row_floor, row_floor + 1, row_floor + 1]),
+                        np.concatenate([col_floor, col_floor + 1, col_floor, col_floor + 1])], axis=1)
+    nodes, inverse = np.unique(corners, axis=0, return_inverse=True)
+    result = get_elevation(
+        list(zip((nodes[:, 0] * size).tolist(), (nodes[:, 1] * size).tolist())), trail_name)
+    if result == -1:
+        return -1
+    corner_elevation = result[0].to_numpy(dtype=float)[inverse].reshape(4, -1)
+    elevation = (corner_elevation[0] * (1 - row_fraction) * (1 - col_fraction) +
+                 corner_elevation[1] * (1 - row_fraction) * col_fraction +
+                 corner_elevation[2] * row_fraction * (1 - col_fraction) +
+                 corner_elevation[3] * row_fraction * col_fraction)
+    return (pd.Series(elevation), result[1])
 
-    if last_called == None:
-        last_called = time.time()
 
-    piped_coords = ''
-    point_count = 0
-    elevations = []
-    for coordinate in coordinates:
-        if piped_coords == '':
-            piped_coords = '{},{}'.format(coordinate[0], coordinate[1])
-            continue
-        piped_coords = piped_coords + \
-            '|{},{}'.format(coordinate[0], coordinate[1])
-        point_count += 1
-        if point_count >= 99:
-            temp_elevations, last_called = elevation_api(
-                piped_coords, last_called, trail_name)
-            api_requests += 1
-            if temp_elevations == -1:
-                return -1
-            piped_coords = ''
-            point_count = 0
-            for point in temp_elevations:
-                elevations.append(point)
-    if piped_coords != '':
-        temp_elevations, last_called = elevation_api(
-            piped_coords, last_called, trail_name)
-        api_requests += 1
-        if temp_elevations == -1:
-            return -1
-        for point in temp_elevations:
-            elevations.append(point)
-    return (pd.Series(elevations), api_requests, last_called)
-
-
-def calculate_dist(coordinates: Union[list, pd.Series]) -> List[float]:
+# mean earth radius in meters, the value the haversine package uses
+EARTH_RADIUS = 6371008.8
+
+
+def haversine_dist(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
     """
-    Accepts a list of coordinates and returns a list of distances between each point
+    Calculates the distance between pairs of points. Uses the same formula as
+    the haversine package, one array operation at a time. Distances between
+    points along a trail are equal to the package's to within 1 ulp.
+
+    #### Arguments:
+
+    - lat1 - array of latitudes of the first points
+    - lon1 - array of longitudes of the first points
+    - lat2 - array of latitudes of the second points
+    - lon2 - array of longitudes of the second points
+
+    #### Returns:
+
+    - distance - array of distances (in meters)
+    """
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+    lat = lat2 - lat1
+    lon = lon2 - lon1
+    d = np.sin(lat * 0.5) ** 2 + np.cos(lat1) * \
+        np.cos(lat2) * np.sin(lon * 0.5) ** 2
+    return EARTH_RADIUS * (2 * np.arcsin(np.sqrt(d)))
+
+
+def coordinates_to_array(coordinates: Union[list, pd.Series]) -> np.ndarray:
+    """
+    Converts a list of coordinates into an array with one row per point
 
     #### Arguments:
 
@@ -158,16 +222,272 @@ def calculate_dist(coordinates: Union[list, pd.Series]) -> List[float]:
 
     #### Returns:
 
-    - distance - list of distances
+    - points - float array with shape (number of points, 2)
     """
-    previous_row = (NAN, NAN)
-    distance = []
-    for row in coordinates:
-        distance.append(hs.haversine(row, previous_row, unit=hs.Unit.METERS))
-        previous_row = row
+    coordinates = list(coordinates)
+    return np.fromiter(chain.from_iterable(coordinates), dtype=float,
+                       count=2 * len(coordinates)).reshape(-1, 2)
+
+
+# coordinates are compared and cached as integers of 1e-8 degrees
+COORDINATE_SCALE = 10 ** 8
+
+
+def coordinate_keys(values: Union[list, np.ndarray, pd.Series]) -> np.ndarray:
+    """
+    Rounds coordinates to 8 decimal places and returns them as integers of
+    1e-8 degrees. Gives the same result as round(Decimal(x), 8), including
+    rounding halfway cases to even.
+
+    #### Arguments:
+
+    - values - list of latitudes or longitudes
+
+    #### Returns:
+
+    - keys - array of int64
+    """
+    values = np.asarray(values, dtype=float)
+    scaled = values * COORDINATE_SCALE
+    # scaled is rounded to the nearest float, which can move a value that is
+    # almost exactly halfway to the other side. The rounding error is found
+    # exactly by splitting values into two halves that multiply without
+    # rounding (Dekker's product), so the exact product decides the side.
+    split = values * 134217729.0
+    high = split - (split - values)
+    low = values - high
+    error = (high * COORDINATE_SCALE - scaled) + low * COORDINATE_SCALE
+    whole = np.floor(scaled)
+    past_half = (scaled - whole - 0.5) + error
+    keys = whole.astype(np.int64)
+    keys += (past_half > 0) | ((past_half == 0) & (keys % 2 == 1))
+    return keys
+
+
+def round_coordinates(point_dfs: List[pd.DataFrame]) -> List[List[Tuple[int, int]]]:
+    """
+    Rounds the coordinates column of each point dataframe to 8 decimal places
+
+    #### Arguments:
+
+    - point_dfs - list of dataframe(lat,lon,coordinates)
+
+    #### Returns:
+
+    - keys - list of (lat, lon) integer pairs (as created by coordinate_keys)
+    for each dataframe
+    """
+    offsets = np.zeros(len(point_dfs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(df) for df in point_dfs])
+    points = coordinates_to_array(
+        [point for df in point_dfs for point in df['coordinates']])
+    lat = coordinate_keys(points[:, 0])
+    lon = coordinate_keys(points[:, 1])
+    keys = list(zip(lat.tolist(), lon.tolist()))
+    coordinates = list(zip((lat / COORDINATE_SCALE).tolist(),
+                           (lon / COORDINATE_SCALE).tolist()))
+    for i, df in enumerate(point_dfs):
+        df['coordinates'] = coordinates[offsets[i]:offsets[i + 1]]
+    return [keys[offsets[i]:offsets[i + 1]] for i in range(len(point_dfs))]
+
+
+def calculate_segment_dist(lat: np.ndarray, lon: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Calculates the distance between each point and the one before it for many
+    trails at once. The points of trail i are lat[offsets[i]:offsets[i + 1]].
+
+    #### Arguments:
+
+    - lat - array of latitudes of every trail, one after the other
+    - lon - array of longitudes of every trail, one after the other
+    - offsets - array of where each trail starts, followed by the total
+    number of points
+
+    #### Returns:
+
+    - distance - array of distances (in meters), NaN for the first point of
+    each trail
+    """
+    distance = np.empty(len(lat))
+    distance[1:] = haversine_dist(lat[1:], lon[1:], lat[:-1], lon[:-1])
+    starts = np.asarray(offsets[:-1])
+    distance[starts[starts < len(lat)]] = NAN
     return distance
 
 
+def calculate_dist(coordinates: Union[list, pd.Series]) -> np.ndarray:
+    """
+    Accepts a list of coordinates and returns a list of distances between each point
+
+    #### Arguments:
+
+    - coordinates - list of coordinates (lat,lon)
+
+    #### Returns:
+
+    - distance - array of distances, NaN for the first point
+    """
+    points = coordinates_to_array(coordinates)
+    return calculate_segment_dist(points[:, 0], points[:, 1], np.array([0, len(points)]))
+
+
+def add_distances(point_dfs: List[pd.DataFrame]) -> None:
+    """
+    Adds a distance column to each point dataframe, calculating every
+    distance in one batch
+
+    #### Arguments:
+
+    - point_dfs - list of dataframes with a coordinates column
+
+    #### Returns:
+
+    - Void
+    """
+    offsets = np.zeros(len(point_dfs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(df) for df in point_dfs])
+    points = coordinates_to_array(
+        [point for df in point_dfs for point in df['coordinates']])
+    distance = calculate_segment_dist(points[:, 0], points[:, 1], offsets)
+    for i, df in enumerate(point_dfs):
+        df['distance'] = distance[offsets[i]:offsets[i + 1]]
+
+
+def densify_points(lat: np.ndarray, lon: np.ndarray, offsets: np.ndarray, max_gap: float, elevation: Union[np.ndarray, None] = None) -> dict:
+    """
+    Adds points to many trails at once so that no two neighboring points are
+    more than max_gap apart. Each gap is halved until it is short enough,
+    with each half checked on its own, giving the same points as inserting
+    one midpoint at a time.
+
+    #### Arguments:
+
+    - lat - array of latitudes of every trail, one after the other
+    - lon - array of longitudes of every trail, one after the other
+    - offsets - array of where each trail starts, followed by the total
+    number of points
+    - max_gap - maximum acceptable gap between points (in meters)
+    - elevation - array of elevations to interpolate as well (default = None)
+
+    #### Returns:
+
+    - points - dict {
+        'lat' (array),
+        'lon' (array),
+        'elevation' (array or None),
+        'offsets' (array, where each trail starts in the new arrays)
+        }
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    include_elevation = elevation is not None
+    if include_elevation:
+        elevation = np.asarray(elevation, dtype=float)
+    else:
+        elevation = np.zeros(len(lat))
+    # a gap is open between point i - 1 and point i unless i starts a trail
+    is_start = np.zeros(len(lat) + 1, dtype=bool)
+    is_start[offsets[:-1]] = True
+    right = np.flatnonzero(~is_start[1:len(lat)]) + 1
+    left = right - 1
+    gap = {
+        'base': left,
+        'left_lat': lat[left], 'left_lon': lon[left],
+        'left_ele': elevation[left], 'left_t': np.zeros(len(left)),
+        'right_lat': lat[right], 'right_lon': lon[right],
+        'right_ele': elevation[right], 'right_t': np.ones(len(left))
+    }
+    new_points = []
+    while len(gap['base']) > 0:
+        distance = haversine_dist(gap['right_lat'], gap['right_lon'],
+                                  gap['left_lat'], gap['left_lon'])
+        split = distance > max_gap
+        gap = {key: value[split] for key, value in gap.items()}
+        midpoint = {
+            'base': gap['base'],
+            'lat': (gap['right_lat'] + gap['left_lat']) / 2,
+            'lon': (gap['right_lon'] + gap['left_lon']) / 2,
+            'ele': (gap['right_ele'] + gap['left_ele']) / 2,
+            't': (gap['left_t'] + gap['right_t']) / 2
+        }
+        new_points.append(midpoint)
+        gap = {
+            'base': np.concatenate([gap['base'], gap['base']]),
+            'left_lat': np.concatenate([gap['left_lat'], midpoint['lat']]),
+            'left_lon': np.concatenate([gap['left_lon'], midpoint['lon']]),
+            'left_ele': np.concatenate([gap['left_ele'], midpoint['ele']]),
+            'left_t': np.concatenate([gap['left_t'], midpoint['t']]),
+            'right_lat': np.concatenate([midpoint['lat'], gap['right_lat']]),
+            'right_lon': np.concatenate([midpoint['lon'], gap['right_lon']]),
+            'right_ele': np.concatenate([midpoint['ele'], gap['right_ele']]),
+            'right_t': np.concatenate([midpoint['t'], gap['right_t']])
+        }
+    # each new point sits between its base point and the next one, at a
+    # fraction t of the way along
+    base = np.concatenate([np.arange(len(lat))] +
+                          [point['base'] for point in new_points])
+    t = np.concatenate([np.zeros(len(lat))] +
+                       [point['t'] for point in new_points])
+    order = np.lexsort((t, base))
+    new_lat = np.concatenate([lat] + [point['lat'] for point in new_points])
+    new_lon = np.concatenate([lon] + [point['lon'] for point in new_points])
+    new_ele = np.concatenate([elevation] +
+                             [point['ele'] for point in new_points])
+    trail = np.searchsorted(offsets, base, side='right') - 1
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    new_offsets[1:] = np.cumsum(np.bincount(trail, minlength=len(offsets) - 1)
+                                [:len(offsets) - 1])
+    return {
+        'lat': new_lat[order],
+        'lon': new_lon[order],
+        'elevation': new_ele[order] if include_elevation else None,
+        'offsets': new_offsets
+    }
+
+
+def fill_in_point_gaps_batch(point_dfs: List[pd.DataFrame], max_gap: int = 20, elevation_included: bool = False) -> List[pd.DataFrame]:
+    """
+    Runs fill_in_point_gaps on many dataframes at once
+
+    #### Arguments:
+    - point_dfs - list of dataframe(lat,lon,coordinates), and optionally an elevation column
+    - max_gap - maximum acceptable gap between points (in meters) (default = 20)
+    - elevation_included - boolean for whether there is an elevation column in the dfs
+
+    #### Returns:
+
+    - new_dfs - list of dataframe(lat,lon,coordinates), and optionally an elevation column
+    """
+    offsets = np.zeros(len(point_dfs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(df) for df in point_dfs])
+    if len(point_dfs) == 0:
+        return []
+    elevation = None
+    if elevation_included == True:
+        elevation = np.concatenate([df['elevation'].to_numpy(dtype=float)
+                                    for df in point_dfs])
+    points = densify_points(
+        np.concatenate([df['lat'].to_numpy(dtype=float) for df in point_dfs]),
+        np.concatenate([df['lon'].to_numpy(dtype=float) for df in point_dfs]),
+        offsets, max_gap, elevation)
+    lat = points['lat'].tolist()
+    lon = points['lon'].tolist()
+    coordinates = list(zip(lat, lon))
+    new_dfs = []
+    for i in range(len(point_dfs)):
+        start, end = points['offsets'][i], points['offsets'][i + 1]
+        columns = {
+            'lat': lat[start:end],
+            'lon': lon[start:end],
+            'coordinates': coordinates[start:end]
+        }
+        if elevation_included == True:
+            columns['elevation'] = points['elevation'][start:end]
+        new_dfs.append(pd.DataFrame(columns))
+    return new_dfs
+
+
 def fill_in_point_gaps(df: pd.DataFrame, max_gap: int = 20, elevation_included: bool = False) -> pd.DataFrame:
     """
     Accepts a dataframe with lat, lon, coordinates, and optionally elevation,
@@ -183,36 +503,7 @@ def fill_in_point_gaps(df: pd.DataFrame, max_gap: int = 20, elevation_included:
 
     - new_df - dataframe(lat,lon,coordinates), and optionally an elevation column
     """
-    lat = df['lat'].tolist()
-    lon = df['lon'].tolist()
-    coordinates = df['coordinates'].tolist()
-    if elevation_included == True:
-        elevation = df['elevation'].tolist()
-    done = False
-    while not done:
-        distances = calculate_dist(coordinates)
-        not_changed = 0
-        for index, point in enumerate(distances):
-            if point > max_gap and index > 0:
-                new_lat = (lat[index]+lat[index-1])/2
-                new_lon = (lon[index]+lon[index-1])/2
-                lat.insert(index, new_lat)
-                lon.insert(index, new_lon)
-                coordinates.insert(index, (new_lat, new_lon))
-                if elevation_included == True:
-                    elevation.insert(
-                        index, (elevation[index]+elevation[index-1])/2)
-                break
-            not_changed += 1
-        if not_changed == len(coordinates):
-            done = True
-    new_df = pd.DataFrame()
-    new_df['lat'] = lat
-    new_df['lon'] = lon
-    new_df['coordinates'] = coordinates
-    if elevation_included == True:
-        new_df['elevation'] = elevation
-    return new_df
+    return fill_in_point_gaps_batch([df], max_gap, elevation_included)[0]
 
 
 def area_to_line(df: pd.DataFrame, point_gap: int = 15) -> pd.DataFrame:
@@ -315,6 +606,38 @@ def set_color(rating: float, difficultly_modifier: Union[int, float] = 0):
         return 'gold'
 
 
+def smooth_elevations_batch(elevation_lists: List[Union[list, pd.Series]], passes: int = 20) -> List[np.ndarray]:
+    """
+    Smooths out errors in the elevation data of many tracks at once. Each pass
+    replaces every point except the first and last of a track with the mean
+    of itself and its two neighbors, using the values from before the pass.
+
+    #### Arguments:
+
+    - elevation_lists - list of lists of elevations, one per track
+    - passes - number of times to repeat smoothing (default = 20)
+
+    #### Returns:
+
+    - elevations - list of arrays of elevations, one per track
+    """
+    lengths = [len(elevations) for elevations in elevation_lists]
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    if offsets[-1] == 0:
+        return [np.zeros(0) for _ in elevation_lists]
+    elevation = np.concatenate([np.asarray(elevations, dtype=float)
+                                for elevations in elevation_lists])
+    interior = np.ones(len(elevation), dtype=bool)
+    interior[offsets[:-1][offsets[:-1] < len(elevation)]] = False
+    interior[offsets[1:] - 1] = False
+    interior = interior[1:-1]
+    for _ in range(passes):
+        average = (elevation[2:] + elevation[1:-1] + elevation[:-2]) / 3
+        np.copyto(elevation[1:-1], average, where=interior)
+    return [elevation[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
 def smooth_elevations(elevations: Union[list, pd.Series], passes: int = 20) -> Union[list, pd.Series]:
     """
     Smooths out errors in elevation data
@@ -331,15 +654,7 @@ def smooth_elevations(elevations: Union[list, pd.Series], passes: int = 20) -> U
     if len(elevations) == 0:
         print('No Elevations provided')
         return
-    for _ in range(passes):
-        previous_previous_point = elevations[0]
-        previous_point = elevations[0]
-        for i, point in enumerate(elevations):
-            new_point = (point + previous_point + previous_previous_point) / 3
-            if i > 1:
-                elevations[i-1] = new_point
-            previous_previous_point = previous_point
-            previous_point = point
+    elevations[:] = smooth_elevations_batch([elevations], passes)[0].tolist()
     return elevations
 
 
@@ -404,6 +719,116 @@ def calculate_point_difficulty(slope: Union[list, pd.Series]) -> List[float]:
     return difficulty
 
 
+def calculate_trail_stats(elevation: np.ndarray, distance: np.ndarray, offsets: np.ndarray) -> dict:
+    """
+    Calculates the slope and difficulty of every point, and the rating,
+    vertical drop and length of every trail, for many trails at once. The
+    values match calculate_elevation_change, calculate_slope,
+    calculate_point_difficulty, rate_trail, calculate_trail_vert and
+    get_trail_length.
+
+    #### Arguments:
+
+    - elevation - array of elevations of every trail, one after the other
+    - distance - array of distances from the previous point (as created by
+    calculate_dist)
+    - offsets - array of where each trail starts, followed by the total
+    number of points. Every trail needs at least one point.
+
+    #### Returns:
+
+    - stats - dict {
+        'elevation_change' (array),
+        'slope' (array),
+        'difficulty' (array),
+        'rating' (list),
+        'vert' (list),
+        'length' (list)
+        }
+    """
+    elevation = np.asarray(elevation, dtype=float)
+    distance = np.asarray(distance, dtype=float)
+    starts = np.asarray(offsets[:-1], dtype=np.int64)
+    if len(elevation) == 0:
+        return {
+            'elevation_change': np.zeros(0), 'slope': np.zeros(0),
+            'difficulty': np.zeros(0), 'rating': [], 'vert': [], 'length': []
+        }
+    elevation_change = np.empty(len(elevation))
+    elevation_change[0] = NAN
+    elevation_change[1:] = elevation[1:] - elevation[:-1]
+    elevation_change[starts] = NAN
+    slope = np.zeros(len(elevation))
+    has_distance = distance != 0
+    has_distance[starts] = False
+    # numpy's arctan can differ from math.atan in the last digit, and the
+    # ratings must not change, so the angle itself is taken from math
+    slope[has_distance] = np.degrees(np.frompyfunc(atan, 1, 1)(
+        elevation_change[has_distance] / distance[has_distance]).astype(float))
+    difficulty = (np.abs(slope) / 90) * .9
+    # the rating is the hardest average of a point and the two before it,
+    # counting points before the start of the trail as 0
+    previous = np.zeros(len(difficulty))
+    previous[1:] = difficulty[:-1]
+    previous[starts] = 0
+    previous_2 = np.zeros(len(difficulty))
+    previous_2[1:] = previous[:-1]
+    previous_2[starts] = 0
+    nearby_avg = (difficulty + previous + previous_2) / 3
+    nearby_avg[~(nearby_avg > 0)] = 0
+    rating = [value if value > 0 else 0
+              for value in np.maximum.reduceat(nearby_avg, starts).tolist()]
+    vert = (np.fmax.reduceat(elevation, starts) -
+            np.fmin.reduceat(elevation, starts)).tolist()
+    distance_list = distance.tolist()
+    length = [sum(distance_list[start + 1:end])
+              for start, end in zip(offsets[:-1], offsets[1:])]
+    return {
+        'elevation_change': elevation_change,
+        'slope': slope,
+        'difficulty': difficulty,
+        'rating': rating,
+        'vert': vert,
+        'length': length
+    }
+
+
+def add_trail_stats(point_dfs: List[pd.DataFrame], difficulty_included: bool = True) -> List[dict]:
+    """
+    Adds elevation_change, slope and optionally difficulty columns to each
+    point dataframe, calculating every value in one batch
+
+    #### Arguments:
+
+    - point_dfs - list of dataframes with elevation and distance columns
+    - difficulty_included - whether to add the difficulty column (default = True)
+
+    #### Returns:
+
+    - stats - list of dict(rating (float), vert (float), length (float)), one
+    per dataframe
+    """
+    offsets = np.zeros(len(point_dfs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(df) for df in point_dfs])
+    if len(point_dfs) == 0:
+        return []
+    stats = calculate_trail_stats(
+        np.concatenate([df['elevation'].to_numpy(dtype=float) for df in point_dfs]),
+        np.concatenate([df['distance'].to_numpy(dtype=float) for df in point_dfs]),
+        offsets)
+    for i, df in enumerate(point_dfs):
+        start, end = offsets[i], offsets[i + 1]
+        df['elevation_change'] = stats['elevation_change'][start:end]
+        df['slope'] = stats['slope'][start:end]
+        if difficulty_included:
+            df['difficulty'] = stats['difficulty'][start:end]
+    return [{
+        'rating': stats['rating'][i],
+        'vert': stats['vert'][i],
+        'length': stats['length'][i]
+    } for i in range(len(point_dfs))]
+
+
 def get_trail_length(coordinates: Union[list, pd.Series]) -> float:
     """
     Calculates the length of a trail from a list of coordinates
@@ -417,7 +842,7 @@ def get_trail_length(coordinates: Union[list, pd.Series]) -> float:
     - length - trail length in meters (float)
     """
     distances = calculate_dist(coordinates)
-    return(sum(distances[1:]))
+    return(sum(distances[1:].tolist()))
 
 
 def format_name(name: str) -> str:
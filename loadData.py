@@ -1,16 +1,211 @@
 import pandas as pd
+import numpy as np
 from os.path import exists
 import time
+from typing import List
 from pip._vendor.rich.progress import track
-from decimal import Decimal
 
 import helper
+import demHelper
 import saveData
 import osmHelper
 import mapHelper
+import resortIndex
 
 
-def generate_trails_and_lifts(mountain: str, blacklist: str = ''):
+def load_point_cache(filename: str) -> pd.DataFrame:
+    """
+    Reads a trail or lift point cache file. Files from before coordinates
+    were cached as integers are converted and saved in the new format the
+    first time they are read.
+
+    #### Arguments:
+
+    - filename - path of the cache file
+
+    #### Returns:
+
+    - df - dataframe(trail_id or lift_id, for_display, lat_e8, lon_e8, elevation,
+    slope, index)
+    """
+    df = pd.read_csv(filename)
+    if 'lat' in df.columns:
+        position = df.columns.get_loc('lat')
+        df.insert(position, 'lat_e8', helper.coordinate_keys(df.lat))
+        df.insert(position + 1, 'lon_e8', helper.coordinate_keys(df.lon))
+        df = df.drop(columns=['lat', 'lon'])
+        df.to_csv(filename, index=False)
+    return df
+
+
+def load_cached_elevations(filename: str) -> dict:
+    """
+    Reads the elevations in a trail or lift point cache file. Points cached
+    without an elevation, which includes approximate ones, are left out so
+    they are fetched again.
+
+    #### Arguments:
+
+    - filename - path of the cache file
+
+    #### Returns:
+
+    - ele_dict - dict {(lat, lon) integer pair: elevation}
+    """
+    df = load_point_cache(filename)
+    df = df[df.elevation.notna()]
+    return dict(zip(zip(df.lat_e8.tolist(), df.lon_e8.tolist()), df.elevation))
+
+
+def fill_from_dem(ele_dict: dict, point_keys: List[List[tuple]], approximate: set = None) -> None:
+    """
+    Reads the elevation of every point that is missing from an elevation
+    dict from the DEM tiles, in one batch
+
+    #### Arguments:
+
+    - ele_dict - dict {(lat, lon) integer pair: elevation}
+    - point_keys - list of lists of (lat, lon) integer pairs (as created by
+    helper.round_coordinates)
+    - approximate - set that the keys read from the tiles are added to, since
+    the tiles are not the API's elevation data (default = None)
+
+    #### Returns:
+
+    - Void
+    """
+    missing = list({key for keys in point_keys for key in keys
+                    if key not in ele_dict})
+    if len(missing) == 0:
+        return
+    points = np.array(missing) / helper.COORDINATE_SCALE
+    elevations = demHelper.sample_dem(
+        demHelper.open_dem_tiles(), points[:, 0], points[:, 1])
+    for key, elevation in zip(missing, elevations.tolist()):
+        # points outside the tiles are left for get_elevation
+        if elevation == elevation:
+            ele_dict[key] = elevation
+            if approximate is not None:
+                approximate.add(key)
+
+
+def fill_from_api(point_sets: List[tuple], name: str, elevation_source: str = 'api', approximate: List[set] = None):
+    """
+    Fetches the elevation of every point that is missing from its elevation
+    dict with a single call to helper.get_elevation. Points from every set
+    are deduplicated and packed together, so requests are only partly
+    filled once per call rather than once per trail.
+
+    #### Arguments:
+
+    - point_sets - list of (ele_dict, point_keys) pairs, where ele_dict is a
+    dict {(lat, lon) integer pair: elevation} and point_keys is a list of
+    lists of (lat, lon) integer pairs (as created by helper.round_coordinates)
+    - name - name used in error messages
+    - elevation_source - 'api', 'dem' or 'grid', see helper.get_elevation (default = 'api')
+    - approximate - list of sets, one for each point set, that the keys
+    fetched for it are added to when elevation_source is 'grid', since those
+    elevations are interpolated (default = None)
+
+    #### Returns:
+
+    - api_requests - number of API requests made
+    - -1 if error
+    """
+    missing = list(dict.fromkeys(key for ele_dict, point_keys in point_sets
+                                 for keys in point_keys for key in keys
+                                 if key not in ele_dict))
+    if len(missing) == 0:
+        return 0
+    result = helper.get_elevation(
+        [(lat / helper.COORDINATE_SCALE, lon / helper.COORDINATE_SCALE)
+         for lat, lon in missing], name, elevation_source)
+    if result == -1:
+        return -1
+    fetched = dict(zip(missing, result[0].tolist()))
+    for i, (ele_dict, point_keys) in enumerate(point_sets):
+        if approximate is not None and elevation_source == 'grid':
+            approximate[i].update(key for key in fetched if key not in ele_dict)
+        ele_dict.update(fetched)
+    return result[1]
+
+
+def interpolate_samples(ele_dict: dict, samples: List[pd.DataFrame], sample_keys: List[List[tuple]], max_gap: int) -> set:
+    """
+    Adds the elevation of every point between sampled points to an elevation
+    dict, interpolated between the samples on either side. Filling in the
+    samples gives the same points as filling in the original ways, so each
+    point gets the key it would have had. Points already in the dict keep
+    their elevation.
+
+    #### Arguments:
+
+    - ele_dict - dict {(lat, lon) integer pair: elevation}, holding the
+    elevation of every sampled point
+    - samples - list of dataframe(lat,lon,coordinates) created by
+    helper.fill_in_point_gaps_batch with a gap wider than max_gap
+    - sample_keys - list of lists of (lat, lon) integer pairs for the samples
+    (as created by helper.round_coordinates)
+    - max_gap - maximum gap between the points to fill in (in meters)
+
+    #### Returns:
+
+    - interpolated - set of the (lat, lon) integer pairs that were added
+    """
+    for df, keys in zip(samples, sample_keys):
+        df['elevation'] = [ele_dict[x] for x in keys]
+    points = helper.fill_in_point_gaps_batch(samples, max_gap, True)
+    interpolated = set()
+    for df, keys in zip(points, helper.round_coordinates(points)):
+        for key, elevation in zip(keys, df['elevation'].tolist()):
+            if key not in ele_dict:
+                ele_dict[key] = elevation
+                interpolated.add(key)
+    return interpolated
+
+
+def unset_extremes(ele_dict: dict, interpolated: set, point_keys: List[List[tuple]], node_keys: List[List[tuple]]) -> None:
+    """
+    Removes the interpolated elevations on either side of the highest and
+    lowest node of each area perimeter from an elevation dict, so they are
+    fetched. The highest and lowest points of the perimeter, which its
+    centerline runs between, are then found from fetched elevations.
+
+    #### Arguments:
+
+    - ele_dict - dict {(lat, lon) integer pair: elevation}
+    - interpolated - set of the (lat, lon) integer pairs in ele_dict that were
+    interpolated (as returned by interpolate_samples)
+    - point_keys - list of lists of (lat, lon) integer pairs for the points of
+    each perimeter
+    - node_keys - list of lists of (lat, lon) integer pairs for the nodes of
+    each perimeter
+
+    #### Returns:
+
+    - Void
+    """
+    for keys, nodes in zip(point_keys, node_keys):
+        nodes = set(nodes)
+        node_index = [i for i, key in enumerate(keys) if key in nodes]
+        elevation = np.array([ele_dict[keys[i]] for i in node_index], dtype=float)
+        if len(node_index) < 2 or np.isnan(elevation).all():
+            continue
+        windows = []
+        for position in [np.nanargmax(elevation), np.nanargmin(elevation)]:
+            windows.append((node_index[max(position - 1, 0)],
+                            node_index[min(position + 1, len(node_index) - 1)]))
+            # the first and last nodes of a closed way are the same point
+            if position == 0 and keys[0] == keys[-1]:
+                windows.append((node_index[-2], node_index[-1]))
+        for start, end in windows:
+            for key in keys[start:end + 1]:
+                if key in interpolated:
+                    del ele_dict[key]
+                    interpolated.discard(key)
+
+
+def generate_trails_and_lifts(mountain: str, blacklist: str = '', resort_index: dict = None, elevation_source: str = 'api', sample_spacing: int = 0):
     """
     Accepts the name of a mountain and the name of a mountain to blacklist
     and returns a tuple with a list of trails and a list of lifts
@@ -20,45 +215,50 @@ def generate_trails_and_lifts(mountain: str, blacklist: str = ''):
     - blacklist - name of a ski area to ignore the trails for
         - if blacklist == mountain, only trails previously found for the mountain
         will be processed
+    - resort_index - dict created by resortIndex.load_resort_index (default =
+    load it from cached/resort_index.json)
+    - elevation_source - 'api', 'dem' or 'grid', see helper.get_elevation (default = 'api')
+    - sample_spacing - most meters between the points that elevations are
+    fetched for, with the points between interpolated (default = 0, every point)
 
     #### Returns:
     - (list(trail dict), list(lift dict))
         - trail dict = name (str), id (str), points_df (df), difficulty_modifier (float), is_area (bool), area_centerline_df (df)
         - lift dict = name (str), points_df (df)
     """
-    filename = mountain + '.osm'
+    osm_filename = osmHelper.find_osm_file(mountain)
     cached_filename = mountain + '.csv'
-    if not exists('osm/{}'.format(filename)):
-        print('osm/{}'.format(filename))
+    if osm_filename is None:
+        print('osm/{}.osm'.format(mountain))
         print('OSM file missing')
         return (-1, -1)
-    if not exists('cached/trails/{}.csv'.format(blacklist)) and blacklist != '':
-        print('Blacklist file missing')
-
-    file = open('osm/{}'.format(filename), 'r', encoding='utf8')
-    raw_table = file.readlines()
-
+    if resort_index is None:
+        resort_index = resortIndex.load_resort_index()
+    blacklist_ids = set()
     if blacklist != '':
-        try:
-            blacklist_ids = (pd.read_csv(
-                'cached/trails/{}.csv'.format(blacklist)))['id'].to_list()
-            blacklist_ids_lifts = (pd.read_csv(
-                'cached/lifts/{}.csv'.format(blacklist))['id'].to_list())
-            blacklist_ids += blacklist_ids_lifts
-            blacklist_ids = [str(x) for x in blacklist_ids]
-        except:
-            blacklist_ids = []
-    else:
-        blacklist_ids = []
+        blacklist_ids = resortIndex.get_blacklist(resort_index, blacklist)
+        if blacklist_ids is None:
+            print('Blacklist file missing')
+            blacklist_ids = set()
 
     whitelist_mode = False
     if blacklist == mountain:
         whitelist_mode = True
-    parsed_osm = osmHelper.process_osm(
-        raw_table, blacklist_ids, whitelist_mode)
+    parsed_osm = osmHelper.load_osm(
+        osm_filename, blacklist_ids, whitelist_mode)
 
     #saveData.save_attributes(parsed_osm['attribute_list'], mountain + '.csv')
 
+    nodes = parsed_osm['nodes']
+    if len(nodes['id']) != 0:
+        bounding_box = [nodes['lat'].min(), nodes['lat'].max(),
+                        nodes['lon'].min(), nodes['lon'].max()]
+        shared = resortIndex.find_shared_ways(
+            resort_index, mountain, parsed_osm['trail_ways']['way_id'] + parsed_osm['lift_ways']['way_id'], bounding_box)
+        for other, count in shared.items():
+            print('{} trails and lifts are also part of {}, use -i {} to leave them out'.format(
+                count, helper.format_name(other), other))
+
     cached = True
     if not exists('cached/trail_points/{}'.format(cached_filename)):
         cached = False
@@ -71,66 +271,98 @@ def generate_trails_and_lifts(mountain: str, blacklist: str = ''):
 
     trail_list = []
     api_requests = 0
+    ele_dict = {}
+    lift_ele_dict = {}
+    # points with elevations that did not come from the API (grid, DEM or
+    # interpolated) are marked as approximate, so they are not cached
+    approximate = set()
+    lift_approximate = set()
     if cached:
-        elevation_df = pd.read_csv(
+        ele_dict = load_cached_elevations(
             'cached/trail_points/{}'.format(cached_filename))
-        elevation_df['coordinates'] = [
-            (round(Decimal(x), 8), round(Decimal(y), 8)) for x, y in zip(elevation_df.lat, elevation_df.lon)]
-        ele_dict = dict(zip(elevation_df.coordinates, elevation_df.elevation))
     if lift_cached:
-        elevation_df = pd.read_csv(
-            'cached/lift_points/{}'.format(cached_filename))
-        elevation_df['coordinates'] = [
-            (round(Decimal(x), 8), round(Decimal(y), 8)) for x, y in zip(elevation_df.lat, elevation_df.lon)]
         try:
-            lift_ele_dict = dict(
-                zip(elevation_df.coordinates, elevation_df.elevation))
+            lift_ele_dict = load_cached_elevations(
+                'cached/lift_points/{}'.format(cached_filename))
         except:
             lift_ele_dict = {}
-    last_called = time.time()
 
     print('Found \033[36m{} trails\033[0m and \033[36m{} lifts\033[0m\n'.format(
         parsed_osm['trail_count'], parsed_osm['lift_count']))
 
-    # insert dummy column so that the progress bar completes properly
-    parsed_osm['way_df'] = pd.concat(
-        [parsed_osm['way_df'], pd.Series(0)], axis=1)
-    for column, _ in zip(parsed_osm['way_df'], track(range(parsed_osm['trail_count']), description="Loading Trails… ")):
-        temp_df = pd.merge((parsed_osm['way_df'])[column], parsed_osm['node_df'],
-                           left_on=column, right_on='id')
-        del temp_df['id']
-        del temp_df[column]
-        temp_df = helper.fill_in_point_gaps(temp_df, 15)
-        temp_df['coordinates'] = [(round(Decimal(x[0]), 8), round(Decimal(x[1]), 8))
-                                  for x in temp_df.coordinates]
-
-        for row in parsed_osm['attribute_list']:
-            if column == row['way_name']:
-                difficulty_modifier = row['difficulty_modifier']
-                area_flag = row['is_area']
-                way_id = row['way_id']
-        try:
-            temp_df['elevation'] = [ele_dict[x] for x in temp_df.coordinates]
-        except:
-            result = helper.get_elevation(
-                temp_df['coordinates'], last_called, column, api_requests)
-            temp_df['elevation'] = result[0]
-            api_requests = result[1]
-            last_called = result[2]
+    trail_ways = parsed_osm['trail_ways']
+    trail_nodes = [osmHelper.get_way_points(trail_ways, i, parsed_osm['nodes'])
+                   for i in range(parsed_osm['trail_count'])]
+    trail_points = helper.fill_in_point_gaps_batch(trail_nodes, 15)
+    trail_keys = helper.round_coordinates(trail_points)
+    lift_ways = parsed_osm['lift_ways']
+    lift_nodes = [osmHelper.get_way_points(lift_ways, i, parsed_osm['nodes'])
+                  for i in range(parsed_osm['lift_count'])]
+    lift_points = helper.fill_in_point_gaps_batch(lift_nodes, 50)
+    lift_keys = helper.round_coordinates(lift_points)
+    # with a sample spacing, elevations are only fetched for the way nodes
+    # and points that far apart, and interpolated for the rest
+    trail_samples, trail_sample_keys = list(trail_points), list(trail_keys)
+    if sample_spacing > 15:
+        trail_samples = helper.fill_in_point_gaps_batch(
+            trail_nodes, sample_spacing)
+        trail_sample_keys = helper.round_coordinates(trail_samples)
+    areas = [i for i in range(parsed_osm['trail_count'])
+             if parsed_osm['attributes'][trail_ways['way_id'][i]]['is_area']]
+    # areas are rated on their centerlines, so with a sample spacing their
+    # perimeters are only fetched at their nodes, which is enough to find
+    # their highest and lowest points. The rest of each perimeter is
+    # interpolated.
+    if sample_spacing > 15:
+        area_nodes = helper.fill_in_point_gaps_batch(
+            [trail_nodes[i] for i in areas], np.inf)
+        for i, nodes, keys in zip(areas, area_nodes, helper.round_coordinates(area_nodes)):
+            trail_samples[i] = nodes
+            trail_sample_keys[i] = keys
+    lift_samples, lift_sample_keys = lift_points, lift_keys
+    if sample_spacing > 50:
+        lift_samples = helper.fill_in_point_gaps_batch(
+            lift_nodes, sample_spacing)
+        lift_sample_keys = helper.round_coordinates(lift_samples)
+    # reading the DEM tiles is cheap, so every point is read from them, and
+    # sampling only applies to points outside the tiles
+    if elevation_source == 'dem':
+        fill_from_dem(ele_dict, trail_keys, approximate)
+        fill_from_dem(lift_ele_dict, lift_keys, lift_approximate)
+    # trail and lift points are fetched together, area centerlines follow
+    # once the perimeter elevations are known
+    result = fill_from_api([(ele_dict, trail_sample_keys), (lift_ele_dict, lift_sample_keys)],
+                           mountain, elevation_source, [approximate, lift_approximate])
+    if result == -1:
+        return (-1, -1)
+    api_requests += result
+    interpolated = set()
+    if sample_spacing > 15:
+        interpolated = interpolate_samples(
+            ele_dict, trail_samples, trail_sample_keys, 15)
+    if sample_spacing > 50:
+        lift_approximate.update(interpolate_samples(
+            lift_ele_dict, lift_samples, lift_sample_keys, 50))
+    area_keys = [trail_keys[i] for i in areas]
+    unset_extremes(ele_dict, interpolated, area_keys,
+                   [trail_sample_keys[i] for i in areas])
+    approximate.update(interpolated)
+    result = fill_from_api([(ele_dict, area_keys)], mountain, elevation_source,
+                           [approximate])
+    if result == -1:
+        return (-1, -1)
+    api_requests += result
+    for i in track(range(parsed_osm['trail_count']), description="Loading Trails… "):
+        column = trail_ways['name'][i]
+        way_id = trail_ways['way_id'][i]
+        difficulty_modifier = parsed_osm['attributes'][way_id]['difficulty_modifier']
+        area_flag = parsed_osm['attributes'][way_id]['is_area']
+        temp_df = trail_points[i]
+        temp_df['elevation'] = [ele_dict[x] for x in trail_keys[i]]
+        temp_df['approximate'] = [x in approximate for x in trail_keys[i]]
         temp_area_line_df = pd.DataFrame()
         if area_flag:
             temp_area_line_df = helper.area_to_line(temp_df)
-            temp_area_line_df['coordinates'] = [
-                (round(Decimal(x[0]), 8), round(Decimal(x[1]), 8)) for x in temp_area_line_df.coordinates]
-            try:
-                temp_area_line_df['elevation'] = [ele_dict[x]
-                                                  for x in temp_area_line_df.coordinates]
-            except:
-                result = helper.get_elevation(
-                    temp_area_line_df['coordinates'], last_called, column, api_requests)
-                temp_area_line_df['elevation'] = result[0]
-                api_requests = result[1]
-                last_called = result[2]
         trail_dict = {
             'name': column,
             'id': way_id,
@@ -140,28 +372,34 @@ def generate_trails_and_lifts(mountain: str, blacklist: str = ''):
             'area_centerline_df': temp_area_line_df
         }
         trail_list.append(trail_dict)
+    area_lines = [trail['area_centerline_df']
+                  for trail in trail_list if trail['is_area']]
+    area_line_keys = helper.round_coordinates(area_lines)
+    area_samples, area_sample_keys = area_lines, area_line_keys
+    if sample_spacing > 15:
+        area_samples = [helper.area_to_line(trail['points_df'], sample_spacing)
+                        for trail in trail_list if trail['is_area']]
+        area_sample_keys = helper.round_coordinates(area_samples)
+    if elevation_source == 'dem':
+        fill_from_dem(ele_dict, area_sample_keys, approximate)
+    result = fill_from_api([(ele_dict, area_sample_keys)], mountain,
+                           elevation_source, [approximate])
+    if result == -1:
+        return (-1, -1)
+    api_requests += result
+    if sample_spacing > 15:
+        approximate.update(interpolate_samples(
+            ele_dict, area_samples, area_sample_keys, 15))
+    for area_line_df, keys in zip(area_lines, area_line_keys):
+        area_line_df['elevation'] = [ele_dict[x] for x in keys]
+        area_line_df['approximate'] = [x in approximate for x in keys]
     lift_list = []
-    # insert dummy column so that the progress bar completes properly
-    parsed_osm['lift_df'] = pd.concat(
-        [parsed_osm['lift_df'], pd.Series(0)], axis=1)
-    for column, _ in zip(parsed_osm['lift_df'], track(range(parsed_osm['lift_count']), description="Loading Lifts…  ")):
-        temp_df = pd.merge(parsed_osm['lift_df'][column], parsed_osm['node_df'],
-                           left_on=column, right_on='id')
-        for row in parsed_osm['attribute_list']:
-            if column == row['way_name']:
-                way_id = row['way_id']
-        temp_df = helper.fill_in_point_gaps(temp_df, 50)
-        temp_df['coordinates'] = [(round(Decimal(x[0]), 8), round(Decimal(x[1]), 8))
-                                  for x in temp_df.coordinates]
-        try:
-            temp_df['elevation'] = [lift_ele_dict[x]
-                                    for x in temp_df.coordinates]
-        except:
-            result = helper.get_elevation(
-                temp_df['coordinates'], last_called, column, api_requests)
-            temp_df['elevation'] = result[0]
-            api_requests = result[1]
-            last_called = result[2]
+    for i in track(range(parsed_osm['lift_count']), description="Loading Lifts…  "):
+        column = lift_ways['name'][i]
+        way_id = lift_ways['way_id'][i]
+        temp_df = lift_points[i]
+        temp_df['elevation'] = [lift_ele_dict[x] for x in lift_keys[i]]
+        temp_df['approximate'] = [x in lift_approximate for x in lift_keys[i]]
         lift_list.append({'name': column, 'id': way_id, 'points_df': temp_df})
     if parsed_osm['trail_count'] == 0:
         print('No trails found.')
@@ -171,7 +409,7 @@ def generate_trails_and_lifts(mountain: str, blacklist: str = ''):
     return (trail_list, lift_list)
 
 
-def process_mountain(mountain: str, cardinal_direction: str = '', save_map: bool = False, blacklist: str = ''):
+def process_mountain(mountain: str, cardinal_direction: str = '', save_map: bool = False, blacklist: str = '', resort_index: dict = None, elevation_source: str = 'api', sample_spacing: int = 0):
     """
     Takes in the general information about the mountain and calls the relevant
     functions to parse the osm, calculate difficulty, and create the map. The
@@ -185,57 +423,40 @@ def process_mountain(mountain: str, cardinal_direction: str = '', save_map: bool
     - blacklist - name of a ski area to ignore the trails for
         - if blacklist == mountain, only trails previously found for the mountain
         will be processed
+    - resort_index - dict created by resortIndex.load_resort_index (default =
+    load it from cached/resort_index.json)
+    - elevation_source - 'api', 'dem' or 'grid', see helper.get_elevation (default = 'api')
+    - sample_spacing - most meters between the points that elevations are
+    fetched for, with the points between interpolated (default = 0, every point)
 
     #### Returns:
 
     - dict(difficulty (float), ease (float), vertical (float), trail_count (int), lift_count (int))
     - -1 in the case of failure
     """
-    trail_list, lift_list = generate_trails_and_lifts(mountain, blacklist)
+    if resort_index is None:
+        resort_index = resortIndex.load_resort_index()
+    trail_list, lift_list = generate_trails_and_lifts(
+        mountain, blacklist, resort_index, elevation_source, sample_spacing)
     if trail_list == -1:
         return -1
 
-    for trail in trail_list:
-        if not trail['is_area']:
-            trail_points = trail['points_df']
-        else:
-            trail_points = trail['area_centerline_df']
-            perimeter = trail['points_df']
-            perimeter['distance'] = helper.calculate_dist(
-                perimeter['coordinates'])
-            perimeter['elevation_change'] = helper.calculate_elevation_change(
-                perimeter['elevation'])
-            perimeter['slope'] = helper.calculate_slope(
-                perimeter['elevation_change'], perimeter['distance'])
-
-        trail_points['distance'] = helper.calculate_dist(
-            trail_points['coordinates'])
-        trail_points['elevation_change'] = helper.calculate_elevation_change(
-            trail_points['elevation'])
-        trail_points['slope'] = helper.calculate_slope(
-            trail_points['elevation_change'], trail_points['distance'])
-        trail_points['difficulty'] = helper.calculate_point_difficulty(
-            trail_points['slope'])
-
-        if not trail['is_area']:
-            trail['points_df'] = trail_points
-        else:
-            trail['points_df'] = perimeter
-            trail['area_centerline_df'] = trail_points
-        trail['difficulty'] = helper.rate_trail(trail_points.difficulty)
+    # distances for every trail, area centerline and lift in one batch
+    helper.add_distances([trail['points_df'] for trail in trail_list] +
+                         [trail['area_centerline_df'] for trail in trail_list if trail['is_area']] +
+                         [lift['points_df'] for lift in lift_list])
+    # slopes for every perimeter and lift, and ratings for every trail and
+    # area centerline, in one batch each
+    helper.add_trail_stats([trail['points_df'] for trail in trail_list if trail['is_area']] +
+                           [lift['points_df'] for lift in lift_list], False)
+    trail_stats = helper.add_trail_stats(
+        [trail['area_centerline_df'] if trail['is_area'] else trail['points_df']
+         for trail in trail_list])
+    for trail, stats in zip(trail_list, trail_stats):
+        trail['difficulty'] = stats['rating']
         trail['steepest_pitch'] = trail['difficulty']
-        trail['vert'] = helper.calculate_trail_vert(trail_points.elevation)
-        trail['length'] = helper.get_trail_length(trail_points.coordinates)
-
-    for lift in lift_list:
-        lift_points = lift['points_df']
-        lift_points['distance'] = helper.calculate_dist(
-            lift_points['coordinates'])
-        lift_points['elevation_change'] = helper.calculate_elevation_change(
-            lift_points['elevation'])
-        lift_points['slope'] = helper.calculate_slope(
-            lift_points['elevation_change'], lift_points['distance'])
-        lift['points_df'] = lift_points
+        trail['vert'] = stats['vert']
+        trail['length'] = stats['length']
 
     if cardinal_direction == '':
         cardinal_direction = mapHelper.find_direction(trail_list, lift_list)
@@ -248,6 +469,7 @@ def process_mountain(mountain: str, cardinal_direction: str = '', save_map: bool
     saveData.cache_trail_points(mountain + '.csv', trail_list)
     saveData.cache_lift_points(mountain + '.csv', lift_list)
     saveData.save_bounding_box(mountain + '.csv', trail_list, lift_list)
+    resortIndex.update_resort_index(resort_index, mountain)
 
     output = {
         'difficulty': mtn_difficulty[0],
@@ -260,7 +482,7 @@ def process_mountain(mountain: str, cardinal_direction: str = '', save_map: bool
     return output
 
 
-def osm(mountain: str, direction: str = '', save_map: bool = False, blacklist: str = '', location: str = ''):
+def osm(mountain: str, direction: str = '', save_map: bool = False, blacklist: str = '', location: str = '', resort_index: dict = None, elevation_source: str = 'api', sample_spacing: int = 0):
     """
     Takes in the general information about the mountain, fills in missing information
     if it is stored from missing runs, calls process mountain, then saves the results
@@ -275,6 +497,11 @@ def osm(mountain: str, direction: str = '', save_map: bool = False, blacklist: s
         - if blacklist == mountain, only trails previously found for the mountain
         will be processed
     - location - what state the mountain is in (2 letter codes)
+    - resort_index - dict created by resortIndex.load_resort_index (default =
+    load it from cached/resort_index.json)
+    - elevation_source - 'api', 'dem' or 'grid', see helper.get_elevation (default = 'api')
+    - sample_spacing - most meters between the points that elevations are
+    fetched for, with the points between interpolated (default = 0, every point)
 
     #### Returns:
 
@@ -282,7 +509,7 @@ def osm(mountain: str, direction: str = '', save_map: bool = False, blacklist: s
     """
 
     if '.osm' in mountain:
-        mountain = mountain.replace('.osm', '')
+        mountain = mountain[:mountain.index('.osm')]
 
     filename = f'{mountain}.osm'
 
@@ -305,7 +532,7 @@ def osm(mountain: str, direction: str = '', save_map: bool = False, blacklist: s
         if str(value) != 'nan':
             direction = value
     mountain_attributes = process_mountain(
-        mountain, direction, save_map, blacklist)
+        mountain, direction, save_map, blacklist, resort_index, elevation_source, sample_spacing)
     if mountain_attributes == -1:
         return -1
     if save_map and exists('mountain_list.csv'):
@@ -328,7 +555,7 @@ def osm(mountain: str, direction: str = '', save_map: bool = False, blacklist: s
     return 0
 
 
-def bulk_osm(input_csv: str = 'mountain_list.csv'):
+def bulk_osm(input_csv: str = 'mountain_list.csv', elevation_source: str = 'api', sample_spacing: int = 0):
     """
     Accepts the name of a csv that contains the information to create maps for
     a list of mountains and calls osm to process each one
@@ -336,6 +563,9 @@ def bulk_osm(input_csv: str = 'mountain_list.csv'):
     #### Arguments:
 
     - input_csv - csv filename with or without the file extension
+    - elevation_source - 'api', 'dem' or 'grid', see helper.get_elevation (default = 'api')
+    - sample_spacing - most meters between the points that elevations are
+    fetched for, with the points between interpolated (default = 0, every point)
 
     #### Return:
 
@@ -345,11 +575,15 @@ def bulk_osm(input_csv: str = 'mountain_list.csv'):
         input_csv += '.csv'
 
     mountain_info_df = pd.read_csv(input_csv, keep_default_na=False)
-    for row in mountain_info_df.itertuples():
-        if row.mountain[0] == '#':
-            continue
-        osm(row.file_name.split('.')[
-            0], row.direction, True, row.blacklist, row.state)
+    rows = [row for row in mountain_info_df.itertuples()
+            if row.mountain[0] != '#']
+    mountains = [row.file_name.split('.')[0] for row in rows]
+    # the index is loaded once and kept up to date as each mountain is saved
+    resort_index = resortIndex.load_resort_index()
+    for i in resortIndex.order_by_blacklist(mountains, [row.blacklist for row in rows]):
+        row = rows[i]
+        osm(mountains[i], row.direction, True,
+            row.blacklist, row.state, resort_index, elevation_source, sample_spacing)
 
 
 def barplot(save_output: bool = False):
@@ -386,7 +620,7 @@ def barplot(save_output: bool = False):
             temp_df, helper.format_name(region), save_output)
 
 
-def create_osm(filename: str = 'mountain_coords.csv'):
+def create_osm(filename: str = 'mountain_coords.csv', compression: str = '', elevation_source: str = 'api', sample_spacing: int = 0):
     """
     Takes a csv filename and fetches an OSM file for each row of coordinates,
     then creates a map of each resort
@@ -394,6 +628,11 @@ def create_osm(filename: str = 'mountain_coords.csv'):
     #### Arguments:
 
     - filename: name of a csv file with name, state, latitude, longitude, and size (s,m,l,xl)
+    - compression: store the fetched files compressed with gz, bz2, or xz
+    (default = '', uncompressed)
+    - elevation_source: 'api', 'dem' or 'grid', see helper.get_elevation (default = 'api')
+    - sample_spacing: most meters between the points that elevations are
+    fetched for, with the points between interpolated (default = 0, every point)
 
     #### Returns:
 
@@ -402,6 +641,12 @@ def create_osm(filename: str = 'mountain_coords.csv'):
     if not exists(filename):
         print('No file found')
         return
+    if compression != '' and '.{}'.format(compression) not in osmHelper.COMPRESSORS:
+        print('Unknown compression: {}'.format(compression))
+        return
+    extension = '.osm'
+    if compression != '':
+        extension += '.{}'.format(compression)
     df = pd.read_csv(filename)
     for row in df.itertuples():
         if row.name[0] == '#':
@@ -420,15 +665,16 @@ def create_osm(filename: str = 'mountain_coords.csv'):
         osm_file = helper.osm_api(bounding_box)
 
         if osm_file != None:
-            f = open(f'osm/{row.name}.osm', 'wb')
+            f = osmHelper.open_osm(f'osm/{row.name}{extension}', 'wb')
             f.write(osm_file)
             f.close()
         else:
             time.sleep(5)
             osm_file = helper.osm_api(bounding_box)
 
-            f = open(f'osm/{row.name}.osm', 'wb')
+            f = osmHelper.open_osm(f'osm/{row.name}{extension}', 'wb')
             f.write(osm_file)
             f.close()
 
-        osm(row.name, '', True, '', row.state)
+        osm(row.name, '', True, '', row.state, elevation_source=elevation_source,
+            sample_spacing=sample_spacing)
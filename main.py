@@ -3,6 +3,7 @@ import sys
 import getopt
 
 import loadData
+import elevationReport
 import gpx
 
 
@@ -17,25 +18,31 @@ def main(argv):
     blacklist = ''
     location = ''
     direction = ''
+    compression = ''
+    elevation_source = 'api'
+    report = ''
+    sample_spacing = '0'
     try:
-        opts, args = getopt.getopt(argv, "hbso:g:d:ci:l:f:", [
-                                   "osm=", "csv", "gpx=", "ignore=", "location=", "fetch-files"])
+        opts, args = getopt.getopt(argv, "hbso:g:d:ci:l:f:z:e:r:p:", [
+                                   "osm=", "csv", "gpx=", "ignore=", "location=", "fetch-files", "compress=", "elevation=", "report=", "spacing="])
     except getopt.GetoptError:
         print(
-            'main.py -o <inputfile> -d <direction> -i <blacklisted_mountain> -l <state> -s')
+            'main.py -o <inputfile> -d <direction> -i <blacklisted_mountain> -l <state> -e <api|dem|grid> -p <meters> -s')
         print('main.py -g <inputfile>')
         print('main.py -c -s')
         print('main.py -b -s')
-        print('main.py -f <filename>')
+        print('main.py -f <filename> -z <gz|bz2|xz>')
+        print('main.py -r <grid|sparse> -p <meters> -o <inputfile>')
         sys.exit(2)
     for opt, arg in opts:
         if opt == '-h':
             print(
-                'main.py -o <inputfile> -d <direction> -i <blacklisted_mountain> -l <state> -s')
+                'main.py -o <inputfile> -d <direction> -i <blacklisted_mountain> -l <state> -e <api|dem|grid> -p <meters> -s')
             print('main.py -g <inputfile>')
             print('main.py -c -s')
             print('main.py -b -s')
-            print('main.py -f <filename>')
+            print('main.py -f <filename> -z <gz|bz2|xz>')
+            print('main.py -r <grid|sparse> -p <meters> -o <inputfile>')
             sys.exit()
         elif opt in ("-o", "--osm"):
             file = arg
@@ -58,15 +65,48 @@ def main(argv):
         elif opt in ("-f", "--fetch-files"):
             file = arg
             osm_fetch = True
+        elif opt in ("-z", "--compress"):
+            compression = arg
+        elif opt in ("-e", "--elevation"):
+            elevation_source = arg
+        elif opt in ("-r", "--report"):
+            report = arg
+        elif opt in ("-p", "--spacing"):
+            sample_spacing = arg
 
+    if elevation_source not in ('api', 'dem', 'grid'):
+        print('Elevation source must be api, dem, or grid')
+        sys.exit(2)
+    if not sample_spacing.isdigit():
+        print('Sample spacing must be a whole number of meters')
+        sys.exit(2)
+    sample_spacing = int(sample_spacing)
+    if report != '':
+        mountains = None
+        if osm_flag:
+            mountain = file
+            if '.osm' in mountain:
+                mountain = mountain[:mountain.index('.osm')]
+            mountains = [mountain]
+        if report == 'grid':
+            elevationReport.grid_report(mountains)
+        elif report == 'sparse' and sample_spacing > 0:
+            elevationReport.sparse_report(sample_spacing, mountains)
+        else:
+            print('Report must be grid, or sparse with -p')
+            sys.exit(2)
+        return False
     show_map = True
     if osm_fetch:
-        loadData.create_osm(file)
+        loadData.create_osm(file, compression,
+                            elevation_source, sample_spacing)
     if csv_flag:
-        loadData.bulk_osm()
+        loadData.bulk_osm(elevation_source=elevation_source,
+                          sample_spacing=sample_spacing)
         show_map = False
     elif osm_flag:
-        loadData.osm(file, direction, save_flag, blacklist, location)
+        loadData.osm(file, direction, save_flag, blacklist, location,
+                     elevation_source=elevation_source, sample_spacing=sample_spacing)
     elif gpx_flag:
         gpx.gpx(file)
     if bar_flag:
@@ -3,6 +3,7 @@ from typing import Tuple
 from typing import List
 import matplotlib.pyplot as plt
 import pandas as pd
+import numpy as np
 
 import helper
 
@@ -23,42 +24,56 @@ def get_label_placement(df: pd.DataFrame, length: int, flip_lat_lon: bool) -> Tu
     - (point, angle) - tuple with the location and angle for the label
     """
     point_count = len(df.coordinates)
-    point_gap = sum(helper.calculate_dist(df.coordinates)[1:])/point_count
+    distances = helper.calculate_dist(df.coordinates)
+    distance_list = distances.tolist()
+    point_gap = sum(distance_list[1:])/point_count
     letter_size = 10 / point_gap
     label_length = point_gap * length * letter_size
     label_length_in_points = int(label_length / point_gap)
     point = int(len(df.coordinates)/2)
-    angle_list = []
-    valid_list = []
-    for i, _ in enumerate(df.coordinates):
-        valid = False
-        if helper.get_trail_length(df.coordinates[0:i]) > label_length / 2:
-            if helper.get_trail_length(df.coordinates[i:-1]) > label_length / 2:
-                valid = True
-        if i == 0:
-            ang = 0
-        else:
-            dx = (df.lat[i])-(df.lat[i-1])
-            dy = (df.lon[i])-(df.lon[i-1])
-            ang = degrees(atan2(dx, dy))
-        angle_list.append(ang)
-        valid_list.append(valid)
+    # distance along the trail before and after each point, from running
+    # totals, matching get_trail_length on df.coordinates[0:i] and [i:-1]
+    before = np.zeros(point_count)
+    before[2:] = np.cumsum(distances[1:-1])
+    after = np.zeros(point_count)
+    after[:-1] = before[-1] - before[1:]
+    valid = before > label_length / 2
+    # the running totals can differ from adding up each stretch in the last
+    # digits, so points right at the cutoff are added up one by one
+    for i in np.flatnonzero(valid & (np.abs(after - label_length / 2) < 1e-6)):
+        after[i] = sum(distance_list[i + 1:-1])
+    valid &= after > label_length / 2
+    lat = df.lat.to_numpy(dtype=float)
+    lon = df.lon.to_numpy(dtype=float)
+    angles = np.zeros(point_count)
+    angles[1:] = np.degrees(np.frompyfunc(atan2, 2, 1)(
+        lat[1:] - lat[:-1], lon[1:] - lon[:-1]).astype(float))
+    # score each valid point by how many angles within half a label of it
+    # are within 5 degrees of their average, using python slice bounds
+    half_window = int(label_length_in_points / 2)
+    candidates = np.flatnonzero(valid)
+    start = candidates - half_window
+    start[start < 0] += point_count
+    start = np.maximum(start, 0)
+    stop = np.minimum(candidates + half_window, point_count)
+    window_length = stop - start
+    candidates = candidates[window_length > 0]
+    start = start[window_length > 0]
+    window_length = window_length[window_length > 0]
     frac_correct = (1, 0, 0)
-    for i, _ in enumerate(angle_list):
-        if valid_list[i]:
-            slice = angle_list[i-int(label_length_in_points / 2):i +
-                               int(label_length_in_points / 2)]
-            if len(slice) == 0:
-                continue
-            expected = sum(slice) / len(slice)
-            frac_correct_current = 0
-            correct = 0
-            for value in slice:
-                if abs(value-expected) < 5:
-                    correct += 1
-            frac_correct_current = correct / len(slice)
-            if frac_correct_current > frac_correct[1]:
-                frac_correct = (i, frac_correct_current, 0)
+    if len(candidates) > 0:
+        steps = np.arange(window_length.max())
+        in_window = steps < window_length[:, None]
+        window = angles[np.minimum(start[:, None] + steps, point_count - 1)]
+        window_sum = np.zeros(len(candidates))
+        for step in steps:
+            window_sum += np.where(in_window[:, step], window[:, step], 0)
+        expected = window_sum / window_length
+        correct = (in_window & (np.abs(window - expected[:, None]) < 5)).sum(axis=1)
+        frac_correct_current = correct / window_length
+        best = np.argmax(frac_correct_current)
+        if frac_correct_current[best] > 0:
+            frac_correct = (int(candidates[best]), frac_correct_current[best], 0)
     if frac_correct[1] != 0:
         point = frac_correct[0]
     if point == 0:
@@ -1,196 +1,1352 @@
+import re
+import csv
+import bz2
+import gzip
+import json
+import lzma
+import zlib
+import struct
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
+from os import cpu_count, makedirs, remove, replace
+from os.path import exists, getsize
+from typing import BinaryIO, Iterator, List, Tuple, Union
+from xml.sax.saxutils import escape, unescape
+import numpy as np
 import pandas as pd
-from typing import List
 
+CHUNK_SIZE = 1 << 20
+# bump whenever a change to the parser or the tag rules would change the
+# output of process_osm, so that stale parse caches are rebuilt
+PARSER_VERSION = 2
+# files at least this large are parsed in a process pool
+PARALLEL_MIN_SIZE = 64 << 20
+SECTIONS_PER_WORKER = 4
+CACHED_ARRAYS = ['node_id', 'node_lat', 'node_lon', 'trail_offsets', 'trail_node_ids',
+                 'trail_node_index', 'lift_offsets', 'lift_node_ids', 'lift_node_index']
 
-def process_way_tags(line: str, trail_attributes: dict) -> dict:
+# Elements are matched straight off the byte stream. Node start tags are
+# pulled out a chunk at a time and their attributes read in bulk, ways are read
+# whole (start tag through </way>) since their tags and nodes are needed.
+NODE_PATTERN = re.compile(rb'<node\s([^>]*)>')
+NODE_START_PATTERN = re.compile(rb'<node(?: id="(-?\d+)")?')
+NODE_ID_PATTERN = re.compile(rb' id="([^"]*)"')
+NODE_LAT_PATTERN = re.compile(rb' lat="([^"]*)"')
+NODE_LON_PATTERN = re.compile(rb' lon="([^"]*)"')
+ELEMENT_PATTERN = re.compile(rb'<(?:node|way|relation)[\s/>]')
+WAY_PATTERN = re.compile(rb'<way\s([^>]*)>')
+WAY_ID_PATTERN = re.compile(rb'\bid="(-?\d+)"')
+TAG_PATTERN = re.compile(r'<tag k="([^"]*)" v="([^"]*)"')
+ND_PATTERN = re.compile(r'<nd ref="(-?\d+)"')
+ENTITIES = {'&quot;': '"', '&apos;': "'"}
+TAG_RULES_FILE = 'tag_rules.csv'
+# osm files are looked up with each of these extensions, in this order
+OSM_EXTENSIONS = ['.osm', '.osm.pbf', '.osm.gz', '.osm.bz2', '.osm.xz']
+COMPRESSORS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+TAG_FLAGS = ['is_trail', 'is_lift', 'is_glade',
+             'is_backcountry', 'is_area', 'glade_override']
+
+
+def parse_nodes(buffer: bytes, start: int, end: int, node_filter: Union[np.ndarray, None] = None) -> Union[Tuple[np.ndarray, np.ndarray, np.ndarray], None]:
+    """
+    Reads every node in a section of an osm file
+
+    #### Arguments:
+
+    - buffer - bytes read from an osm file
+    - start - index to start reading from
+    - end - index to stop reading at, must not fall inside a tag
+    - node_filter - sorted int64 array of node ids to keep (default = keep
+    every node)
+
+    #### Returns:
+
+    - (id (int64 array), lat (array), lon (array))
+    - None if there are no nodes in the section
+    """
+    # the patterns only have to search from the first node to the end of the
+    # last one, which skips the ways that follow the nodes in an osm file
+    start = buffer.find(b'<node', start, end)
+    if start == -1:
+        return None
+    end = buffer.find(b'>', buffer.rfind(b'<node', start, end), end) + 1
+    # lat and lon are only ever node attributes, so when id comes first in
+    # every node the attributes can be read straight from the buffer
+    id = NODE_START_PATTERN.findall(buffer, start, end)
+    lat = NODE_LAT_PATTERN.findall(buffer, start, end)
+    lon = NODE_LON_PATTERN.findall(buffer, start, end)
+    if b'' in id or not len(id) == len(lat) == len(lon):
+        # every node has exactly one of each attribute, so reading them from
+        # the joined start tags keeps the three lists lined up
+        start_tags = b' ' + b' '.join(NODE_PATTERN.findall(buffer, start, end))
+        id = NODE_ID_PATTERN.findall(start_tags)
+        lat = NODE_LAT_PATTERN.findall(start_tags)
+        lon = NODE_LON_PATTERN.findall(start_tags)
+    id = np.fromstring(b' '.join(id), dtype=np.int64, sep=' ')
+    if node_filter is None:
+        lat = np.array(list(map(float, lat)))
+        lon = np.array(list(map(float, lon)))
+        return (id, lat, lon)
+    keep = np.flatnonzero(np.isin(id, node_filter))
+    if len(keep) == 0:
+        return None
+    lat = np.array([float(lat[i]) for i in keep])
+    lon = np.array([float(lon[i]) for i in keep])
+    return (id[keep], lat, lon)
+
+
+def find_chunk_end(buffer: bytes) -> int:
+    """
+    Finds the last point in a partially read osm file where it can be split
+    without cutting through a tag or a way
+
+    #### Arguments:
+
+    - buffer - bytes read from an osm file
+
+    #### Returns:
+
+    - end - index of the split point
+    """
+    end = buffer.rfind(b'>') + 1
+    # ways only hold nd and tag elements, so any way open at the end starts
+    # after the last node
+    way_start = buffer.rfind(b'<way', max(buffer.rfind(b'<node', 0, end), 0), end)
+    if way_start == -1:
+        return end
+    start_tag_end = buffer.find(b'>', way_start, end)
+    if start_tag_end == -1:
+        return way_start
+    if buffer[start_tag_end - 1:start_tag_end] == b'/':
+        return end
+    if buffer.find(b'</way>', start_tag_end, end) == -1:
+        return way_start
+    return end
+
+
+def find_ways(buffer: bytes, end: int, way_key_pattern: Union[re.Pattern, None] = None) -> Iterator[Tuple[re.Match, int]]:
+    """
+    Finds the ways in a partially read osm file
+
+    #### Arguments:
+
+    - buffer - bytes read from an osm file
+    - end - index to stop reading at, must not fall inside a way
+    - way_key_pattern - compiled pattern matching the tags a way needs to be
+    kept (default = keep every way)
+
+    #### Returns:
+
+    - iterator of (start tag match, index the way's body ends at) tuples, in
+    file order
+    """
+    start = max(buffer.find(b'<way', 0, end), 0)
+    if way_key_pattern is None:
+        for way in WAY_PATTERN.finditer(buffer, start, end):
+            if way.group(1).endswith(b'/'):
+                yield (way, way.end())
+            else:
+                yield (way, buffer.find(b'</way>', way.end(), end))
+        return
+    # few ways have a matching tag, so the tags are found first and each is
+    # traced back to the way it is in, if any
+    way_end = -1
+    for tag in way_key_pattern.finditer(buffer, start, end):
+        if tag.start() < way_end:
+            continue
+        way_start = buffer.rfind(b'<way', 0, tag.start())
+        way = None if way_start == -1 else WAY_PATTERN.match(buffer, way_start)
+        if way is None or way.group(1).endswith(b'/'):
+            continue
+        way_end = buffer.find(b'</way>', way.end(), end)
+        if way_end > tag.start():
+            yield (way, way_end)
+
+
+def iter_osm(file: Union[str, BinaryIO], chunk_size: int = CHUNK_SIZE, read_nodes: bool = True, read_ways: bool = True, node_filter: Union[np.ndarray, None] = None, start: int = 0, stop: Union[int, None] = None, way_keys: Union[set, None] = None) -> Iterator[Tuple[str, tuple]]:
+    """
+    Streams an osm file and yields nodes and ways as they are read. Only one
+    chunk of the file is held in memory at a time.
+
+    #### Arguments:
+
+    - file - path to an osm file (xml, compressed xml or pbf) or an xml file
+    opened in binary mode
+    - chunk_size - number of bytes to read at a time (default = 1 MB)
+    - read_nodes - whether to yield nodes (default = True)
+    - read_ways - whether to yield ways (default = True)
+    - node_filter - sorted int64 array of node ids to keep (default = keep
+    every node)
+    - start - byte offset to start reading from, must be the start of an
+    element, uncompressed xml only (default = 0)
+    - stop - byte offset to stop reading at, must be the start of an element,
+    uncompressed xml only (default = end of file)
+    - way_keys - set of tag keys. Xml ways without a tag with one of these
+    keys are skipped before they are read, pbf ways are all yielded
+    (default = yield every way)
+
+    #### Returns:
+
+    - iterator of ('nodes', (id (int64 array), lat (array), lon (array)))
+    and ('way', (way_id (str), tags (list(tuple)), node_id_list (list))) tuples
+    """
+    if isinstance(file, str):
+        with open_osm(file) as osm_file:
+            if file.endswith('.pbf'):
+                yield from iter_pbf(osm_file, read_nodes, read_ways,
+                                    node_filter)
+            else:
+                yield from iter_osm(osm_file, chunk_size, read_nodes,
+                                    read_ways, node_filter, start, stop,
+                                    way_keys)
+        return
+    way_key_pattern = None
+    if way_keys is not None:
+        # matched on the raw bytes, so keys are escaped the way they are
+        # written in the file
+        way_key_pattern = re.compile(b'<tag k="(?:' + b'|'.join(
+            re.escape(escape(key, {'"': '&quot;'}).encode('utf8'))
+            for key in sorted(way_keys)) + b')"')
+    if start:
+        file.seek(start)
+    remaining = None if stop is None else stop - start
+    tail = b''
+    while True:
+        if remaining is None:
+            chunk = file.read(chunk_size)
+        else:
+            chunk = file.read(min(chunk_size, remaining))
+            remaining -= len(chunk)
+        buffer = tail + chunk
+        if chunk:
+            end = find_chunk_end(buffer)
+        else:
+            end = len(buffer)
+        if read_nodes:
+            nodes = parse_nodes(buffer, 0, end, node_filter)
+            if nodes is not None:
+                yield ('nodes', nodes)
+        if read_ways:
+            for way, way_end in find_ways(buffer, end, way_key_pattern):
+                body = buffer[way.end():way_end].decode('utf8')
+                way_id = WAY_ID_PATTERN.search(way.group(1)).group(1).decode()
+                tags = TAG_PATTERN.findall(body)
+                if '&' in body:
+                    tags = [(unescape(k, ENTITIES), unescape(v, ENTITIES))
+                            for k, v in tags]
+                node_id_list = ND_PATTERN.findall(body)
+                yield ('way', (way_id, tags, node_id_list))
+        tail = buffer[end:]
+        if not chunk:
+            return
+
+
+def find_osm_file(mountain: str) -> Union[str, None]:
     """
-    Adds / Removes tags based on the passed line from an osm file
+    Finds the osm file for a mountain in the osm directory
 
     #### Arguments:
 
-    - line - one line from an osm file
+    - mountain - name of a ski area / name of an osm file w/o the file extension
+
+    #### Returns:
+
+    - filename - path to the osm file, or None if there isn't one
+    """
+    for extension in OSM_EXTENSIONS:
+        filename = 'osm/{}{}'.format(mountain, extension)
+        if exists(filename):
+            return filename
+    return None
+
+
+def open_osm(filename: str, mode: str = 'rb') -> BinaryIO:
+    """
+    Opens an osm file, decompressing or compressing it based on its extension
+
+    #### Arguments:
+
+    - filename - path to an osm file
+    - mode - 'rb' to read or 'wb' to write (default = 'rb')
+
+    #### Returns:
+
+    - file - file object in binary mode
+    """
+    for extension, compressor in COMPRESSORS.items():
+        if filename.endswith(extension):
+            return compressor(filename, mode)
+    return open(filename, mode)
+
+
+def read_varint(buffer: bytes, position: int) -> Tuple[int, int]:
+    """
+    Reads one protobuf varint
+
+    #### Arguments:
+
+    - buffer - protobuf message
+    - position - index of the first byte of the varint
+
+    #### Returns:
+
+    - (value, index of the byte after the varint)
+    """
+    value = buffer[position]
+    if value < 0x80:
+        return (value, position + 1)
+    value &= 0x7f
+    shift = 7
+    position += 1
+    while True:
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (value, position)
+        shift += 7
+
+
+def read_fields(buffer: bytes) -> Iterator[Tuple[int, Union[int, bytes]]]:
+    """
+    Reads the fields of a protobuf message
+
+    #### Arguments:
+
+    - buffer - protobuf message
+
+    #### Returns:
+
+    - iterator of (field number, value) tuples, value is an int for varints
+    and bytes for everything else
+    """
+    position = 0
+    end = len(buffer)
+    while position < end:
+        key = buffer[position]
+        if key < 0x80:
+            position += 1
+        else:
+            key, position = read_varint(buffer, position)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, position = read_varint(buffer, position)
+        elif wire_type == 2:
+            length, position = read_varint(buffer, position)
+            value = buffer[position:position + length]
+            position += length
+        elif wire_type == 1:
+            value = buffer[position:position + 8]
+            position += 8
+        elif wire_type == 5:
+            value = buffer[position:position + 4]
+            position += 4
+        else:
+            raise ValueError(
+                'Unsupported protobuf wire type {}'.format(wire_type))
+        yield (key >> 3, value)
+
+
+def decode_varints(data: bytes, signed: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads a run of protobuf varints, such as a packed repeated field, at once
+
+    #### Arguments:
+
+    - data - bytes of back to back varints
+    - signed - whether the values are zigzag encoded (sint64)
+
+    #### Returns:
+
+    - values - int64 array
+    - ends - index of the last byte of each varint
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) == 0:
+        return (np.zeros(0, dtype=np.int64), ends)
+    data = data[:ends[-1] + 1]
+    starts = np.zeros(len(ends), dtype=np.int64)
+    starts[1:] = ends[:-1] + 1
+    shift = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7f).astype(np.uint64) << (
+        7 * shift).astype(np.uint64)
+    values = np.bitwise_or.reduceat(parts, starts)
+    if signed:
+        return ((values >> np.uint64(1)).astype(np.int64) ^
+                -(values & np.uint64(1)).astype(np.int64), ends)
+    return (values.astype(np.int64), ends)
+
+
+def decode_packed_runs(runs: List[bytes], signed: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads several packed repeated fields, one per element, in one go
+
+    #### Arguments:
+
+    - runs - list of packed field contents
+    - signed - whether the values are zigzag encoded (sint64)
+
+    #### Returns:
+
+    - values - int64 array of every value, in order
+    - offsets - values of run i are values[offsets[i]:offsets[i + 1]]
+    """
+    values, ends = decode_varints(b''.join(runs), signed)
+    boundaries = np.cumsum([len(run) for run in runs])
+    offsets = np.zeros(len(runs) + 1, dtype=np.int64)
+    offsets[1:] = np.searchsorted(ends, boundaries)
+    return (values, offsets)
+
+
+def read_pbf_blocks(file: BinaryIO) -> Iterator[bytes]:
+    """
+    Reads the data blocks of an osm pbf file, one at a time
+
+    #### Arguments:
+
+    - file - pbf file opened in binary mode
+
+    #### Returns:
+
+    - iterator of uncompressed PrimitiveBlock messages
+    """
+    while True:
+        header_size = file.read(4)
+        if len(header_size) < 4:
+            return
+        header = file.read(struct.unpack('>I', header_size)[0])
+        block_type = ''
+        block_size = 0
+        for field, value in read_fields(header):
+            if field == 1:
+                block_type = bytes(value).decode()
+            elif field == 3:
+                block_size = value
+        blob = file.read(block_size)
+        if block_type != 'OSMData':
+            continue
+        data = None
+        for field, value in read_fields(blob):
+            if field == 1:
+                data = value
+            elif field == 3:
+                data = zlib.decompress(value)
+            elif field == 4:
+                data = lzma.decompress(value)
+        if data is None:
+            raise ValueError('Unsupported pbf block compression')
+        yield data
+
+
+def read_pbf_nodes(group: List[Tuple[int, bytes]], block: dict, node_filter: Union[np.ndarray, None]) -> Union[Tuple[np.ndarray, np.ndarray, np.ndarray], None]:
+    """
+    Reads the nodes in a pbf PrimitiveGroup
+
+    #### Arguments:
+
+    - group - list of (field number, value) tuples of the PrimitiveGroup
+    - block - dict of the stringtable, granularity and offsets of the block
+    - node_filter - sorted int64 array of node ids to keep, or None to keep
+    every node
+
+    #### Returns:
+
+    - (id (int64 array), lat (array), lon (array))
+    - None if there are no nodes to keep
+    """
+    id = []
+    lat = []
+    lon = []
+    for group_field, message in group:
+        if group_field == 2:
+            # dense nodes store each column packed and delta coded
+            for field, value in read_fields(message):
+                if field == 1:
+                    id.append(np.cumsum(decode_varints(value, True)[0]))
+                elif field == 8:
+                    lat.append(np.cumsum(decode_varints(value, True)[0]))
+                elif field == 9:
+                    lon.append(np.cumsum(decode_varints(value, True)[0]))
+        elif group_field == 1:
+            node = {1: 0, 8: 0, 9: 0}
+            for field, value in read_fields(message):
+                if field in node:
+                    node[field] = (value >> 1) ^ -(value & 1)
+            id.append(np.array([node[1]], dtype=np.int64))
+            lat.append(np.array([node[8]], dtype=np.int64))
+            lon.append(np.array([node[9]], dtype=np.int64))
+    if len(id) == 0:
+        return None
+    id = np.concatenate(id)
+    lat = np.concatenate(lat)
+    lon = np.concatenate(lon)
+    if node_filter is not None:
+        keep = np.isin(id, node_filter)
+        id, lat, lon = id[keep], lat[keep], lon[keep]
+    if len(id) == 0:
+        return None
+    # positions are stored in nanodegrees, dividing the exact integer gives
+    # the same float as reading the decimal string from an xml file
+    lat = (block['lat_offset'] + block['granularity'] * lat) / 1e9
+    lon = (block['lon_offset'] + block['granularity'] * lon) / 1e9
+    return (id, lat, lon)
+
+
+def read_pbf_ways(ways: List[bytes], block: dict) -> Iterator[Tuple[str, List[Tuple[str, str]], List[str]]]:
+    """
+    Reads the ways in a pbf PrimitiveGroup
+
+    #### Arguments:
+
+    - ways - list of Way messages
+    - block - dict of the stringtable, granularity and offsets of the block
+
+    #### Returns:
+
+    - iterator of (way_id (str), tags (list(tuple)), node_id_list (list))
+    """
+    strings = block['strings']
+    way_ids = []
+    keys = []
+    vals = []
+    refs = []
+    for way in ways:
+        way_id = 0
+        way_keys = b''
+        way_vals = b''
+        way_refs = b''
+        for field, value in read_fields(way):
+            if field == 1:
+                way_id = value
+            elif field == 2:
+                way_keys = value
+            elif field == 3:
+                way_vals = value
+            elif field == 8:
+                way_refs = value
+        way_ids.append(way_id)
+        keys.append(way_keys)
+        vals.append(way_vals)
+        refs.append(way_refs)
+    keys, offsets = decode_packed_runs(keys)
+    vals = decode_packed_runs(vals)[0]
+    refs, ref_offsets = decode_packed_runs(refs, True)
+    # node refs are delta coded within each way
+    refs = np.cumsum(refs)
+    refs -= np.repeat(np.concatenate(([0], refs))[ref_offsets[:-1]],
+                      np.diff(ref_offsets))
+    refs = refs.astype(str).tolist()
+    keys = keys.tolist()
+    vals = vals.tolist()
+    for i, way_id in enumerate(way_ids):
+        tags = [(strings[keys[j]], strings[vals[j]])
+                for j in range(offsets[i], offsets[i + 1])]
+        yield (str(way_id), tags, refs[ref_offsets[i]:ref_offsets[i + 1]])
+
+
+def iter_pbf(file: BinaryIO, read_nodes: bool = True, read_ways: bool = True, node_filter: Union[np.ndarray, None] = None) -> Iterator[Tuple[str, tuple]]:
+    """
+    Streams an osm pbf file and yields nodes and ways as they are read, in the
+    same form as iter_osm. Only one block of the file is held in memory at a
+    time.
+
+    #### Arguments:
+
+    - file - pbf file opened in binary mode
+    - read_nodes - whether to yield nodes (default = True)
+    - read_ways - whether to yield ways (default = True)
+    - node_filter - sorted int64 array of node ids to keep (default = keep
+    every node)
+
+    #### Returns:
+
+    - iterator of ('nodes', (id (int64 array), lat (array), lon (array)))
+    and ('way', (way_id (str), tags (list(tuple)), node_id_list (list))) tuples
+    """
+    for data in read_pbf_blocks(file):
+        block = {'strings': [], 'granularity': 100,
+                 'lat_offset': 0, 'lon_offset': 0}
+        groups = []
+        for field, value in read_fields(data):
+            if field == 1:
+                block['strings'] = [bytes(x).decode('utf8')
+                                    for _, x in read_fields(value)]
+            elif field == 2:
+                groups.append(value)
+            elif field == 17:
+                block['granularity'] = value
+            elif field == 19:
+                block['lat_offset'] = value - (1 << 64) * (value >> 63)
+            elif field == 20:
+                block['lon_offset'] = value - (1 << 64) * (value >> 63)
+        for group in groups:
+            group = list(read_fields(group))
+            if read_nodes:
+                nodes = read_pbf_nodes(group, block, node_filter)
+                if nodes is not None:
+                    yield ('nodes', nodes)
+            if read_ways:
+                ways = [value for field, value in group if field == 3]
+                for way in read_pbf_ways(ways, block):
+                    yield ('way', way)
+
+
+def index_nodes(id: np.ndarray, lat: np.ndarray, lon: np.ndarray) -> dict:
+    """
+    Sorts the nodes of an osm file by id so they can be looked up with a
+    binary search
+
+    #### Arguments:
+
+    - id - array of node ids (int64)
+    - lat - array of latitudes
+    - lon - array of longitudes
+
+    #### Returns:
+
+    - nodes - dict {
+        'id' (sorted int64 array),
+        'lat' (array),
+        'lon' (array)
+        }
+    """
+    order = np.argsort(id, kind='stable')
+    nodes = {
+        'id': id[order],
+        'lat': lat[order],
+        'lon': lon[order]
+    }
+    return nodes
+
+
+def locate_nodes(nodes: dict, node_ids: np.ndarray) -> np.ndarray:
+    """
+    Finds the position of each node id in a table created by index_nodes
+
+    #### Arguments:
+
+    - nodes - dict created by index_nodes
+    - node_ids - array of node ids (int64)
+
+    #### Returns:
+
+    - node_index - array of positions, -1 where the node is missing from
+    the file
+    """
+    if len(nodes['id']) == 0:
+        return np.full(len(node_ids), -1, dtype=np.int64)
+    node_index = np.searchsorted(nodes['id'], node_ids)
+    node_index[node_index == len(nodes['id'])] = 0
+    node_index[nodes['id'][node_index] != node_ids] = -1
+    return node_index
+
+
+def pack_ways(way_ids: List[str], names: List[str], node_id_lists: List[List[str]], nodes: dict) -> dict:
+    """
+    Packs a group of ways into flat arrays. The nodes of the way in row i are
+    node_ids[offsets[i]:offsets[i + 1]], node_index holds where each of those
+    nodes sits in the node table.
+
+    #### Arguments:
+
+    - way_ids - list of way ids
+    - names - list of way names
+    - node_id_lists - list of node id lists, one per way
+    - nodes - dict created by index_nodes
+
+    #### Returns:
+
+    - ways - dict {
+        'way_id' (list),
+        'name' (list),
+        'offsets' (array),
+        'node_ids' (int64 array),
+        'node_index' (int64 array),
+        'index' (dict(way_id: row))
+        }
+    """
+    offsets = np.zeros(len(node_id_lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(x) for x in node_id_lists])
+    node_ids = np.array(
+        [x for node_id_list in node_id_lists for x in node_id_list], dtype=np.int64)
+    ways = {
+        'way_id': way_ids,
+        'name': names,
+        'offsets': offsets,
+        'node_ids': node_ids,
+        'node_index': locate_nodes(nodes, node_ids),
+        'index': {way_id: i for i, way_id in enumerate(way_ids)}
+    }
+    return ways
+
+
+def get_way_nodes(ways: dict, row: int) -> np.ndarray:
+    """
+    Returns the node ids of one way from a table created by pack_ways
+
+    #### Arguments:
+
+    - ways - dict created by pack_ways
+    - row - position of the way in the table, use ways['index'] to look
+    up a way by id
+
+    #### Returns:
+
+    - node_ids - array of node ids
+    """
+    return ways['node_ids'][ways['offsets'][row]:ways['offsets'][row + 1]]
+
+
+def get_way_points(ways: dict, row: int, nodes: dict) -> pd.DataFrame:
+    """
+    Looks up the coordinates of one way from a table created by pack_ways.
+    Nodes missing from the file are dropped. A node that appears more than
+    once (like the closing node of an area) is grouped with its first
+    appearance, which is the order the cached elevations were built with.
+
+    #### Arguments:
+
+    - ways - dict created by pack_ways
+    - row - position of the way in the table
+    - nodes - dict created by index_nodes
+
+    #### Returns:
+
+    - df - dataframe(lat,lon,coordinates)
+    """
+    node_index = ways['node_index'][ways['offsets'][row]:ways['offsets'][row + 1]]
+    node_index = node_index[node_index != -1]
+    _, first, inverse = np.unique(
+        node_index, return_index=True, return_inverse=True)
+    if len(first) != len(node_index):
+        node_index = node_index[np.argsort(first[inverse], kind='stable')]
+    lat = nodes['lat'][node_index]
+    lon = nodes['lon'][node_index]
+    df = pd.DataFrame({
+        'lat': lat,
+        'lon': lon,
+        'coordinates': list(zip(lat.tolist(), lon.tolist()))
+    })
+    return df
+
+
+def compile_tag_rules(rules: List[dict]) -> dict:
+    """
+    Compiles a list of tag rules into lookup tables keyed on the tag key, so
+    each tag of a way only has to be checked against the rules for its key
+
+    #### Arguments:
+
+    - rules - list of dicts with key, match, value, flag and modifier
+    (see tag_rules.csv)
+
+    #### Returns:
+
+    - tag_rules - dict {
+        'by_key' (dict(key: dict)),
+        'any_key' (list(tuple)),
+        'classifying_keys' (set, None if every way has to be classified),
+        'digest' (str),
+        'matches' (dict((key, value): actions), for keys in by_key)
+        }
+    """
+    tag_rules = {
+        'by_key': {},
+        'any_key': [],
+        'classifying_keys': set(),
+        'digest': hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf8')).hexdigest(),
+        'matches': {}
+    }
+    for rule in rules:
+        key = rule['key']
+        match = rule['match']
+        value = rule['value'] or ''
+        if rule['flag'] not in TAG_FLAGS:
+            raise ValueError('Unknown flag in tag rules: {}'.format(rule['flag']))
+        action = (rule['flag'], int(rule['modifier'] or 0))
+        if rule['flag'] in ['is_trail', 'is_lift'] and tag_rules['classifying_keys'] is not None:
+            tag_rules['classifying_keys'].add(key)
+            if key == '*':
+                # any way could become a trail or lift, so none can be skipped
+                tag_rules['classifying_keys'] = None
+        if key == '*':
+            if match != 'contains':
+                raise ValueError(
+                    'Rules for any key must use contains: {}'.format(rule))
+            tag_rules['any_key'].append((value, action))
+            continue
+        key_rules = tag_rules['by_key'].setdefault(
+            key, {'any': [], 'equals': {}, 'contains': [], 'except': []})
+        if match == 'any':
+            key_rules['any'].append(action)
+        elif match == 'equals':
+            key_rules['equals'].setdefault(value, []).append(action)
+        elif match == 'contains':
+            key_rules['contains'].append((value, action))
+        elif match == 'except':
+            key_rules['except'].append((set(value.split(';')), action))
+        else:
+            raise ValueError('Unknown match type in tag rules: {}'.format(match))
+    return tag_rules
+
+
+def load_tag_rules(filename: str = TAG_RULES_FILE) -> dict:
+    """
+    Reads and compiles the tag rules used to classify ways
+
+    #### Arguments:
+
+    - filename - csv file with key, match, value, flag and modifier columns
+    (default = tag_rules.csv)
+
+    #### Returns:
+
+    - tag_rules - dict created by compile_tag_rules
+    """
+    with open(filename, 'r', encoding='utf8', newline='') as rules_file:
+        rules = list(csv.DictReader(rules_file))
+    return compile_tag_rules(rules)
+
+
+def match_tag_rules(key: str, value: str, tag_rules: dict) -> tuple:
+    """
+    Finds the rules that apply to a tag. For keys with rules of their own,
+    the result is remembered in tag_rules['matches'] since the same tags show
+    up on many ways. Other keys, such as name, can have any value, so they
+    are checked against the any key rules every time.
+
+    #### Arguments:
+
+    - key - tag key
+    - value - tag value
+    - tag_rules - dict created by compile_tag_rules
+
+    #### Returns:
+
+    - actions - tuple of (flag, modifier) tuples
+    """
+    actions = []
+    key_rules = tag_rules['by_key'].get(key)
+    if key_rules is not None:
+        actions += key_rules['any']
+        actions += key_rules['equals'].get(value, [])
+        for text, action in key_rules['contains']:
+            if text in value:
+                actions.append(action)
+        for values, action in key_rules['except']:
+            if value not in values:
+                actions.append(action)
+    for text, action in tag_rules['any_key']:
+        if text in key or text in value:
+            actions.append(action)
+    actions = tuple(actions)
+    if key_rules is not None:
+        tag_rules['matches'][(key, value)] = actions
+    return actions
+
+
+def process_way_tags(tags: List[Tuple[str, str]], trail_attributes: dict, tag_rules: dict) -> dict:
+    """
+    Adds / Removes tags based on the tags of a way from an osm file. A rule
+    sets its flag and, the first time the flag is set, adds its modifier to
+    the difficulty modifier.
+
+    #### Arguments:
+
+    - tags - list of (key, value) tuples
     - trail_attributes - dict of trail tags. Created by process_osm
+    - tag_rules - dict created by compile_tag_rules
 
     #### Returns:
 
     - trail_attributes - dict of trail tags
     """
-    if '<nd' in line:
-        split_row = line.split('"')
-        if split_row[1] != '':
-            trail_attributes['node_id_list'].append(split_row[1])
-    if '<tag k="name"' in line:
-        split_row = line.split('"')
-        trail_attributes['way_name'] = split_row[3]
-    if '<tag k="piste:difficulty"' in line:
-        trail_attributes['is_trail'] = True
-    if '<tag k="piste:type"' in line and 'downhill' in line:
-        trail_attributes['is_trail'] = True
-    if '<tag k="piste:type"' in line and 'backcountry' in line:
-        trail_attributes['is_backcountry'] = True
-    if '<tag k="piste:type"' in line and 'nordic' in line:
-        trail_attributes['is_backcountry'] = True
-    if '<tag k="piste:type"' in line and 'skitour' in line:
-        trail_attributes['is_backcountry'] = True
-    if '<tag k="landuse" v="grass"/>' in line:
-        trail_attributes['is_backcountry'] = True
-    if '<tag k="natural" v="grassland"/>' in line:
-        trail_attributes['is_backcountry'] = True
-    if '<tag k="piste:grooming" v="classic+skating"/>' in line:
-        trail_attributes['is_backcountry'] = True
-    if '<tag k="piste:type" v="hike"/>' in line:
-        trail_attributes['is_backcountry'] = True
-    if '<tag k="mtb:scale:imba"' in line:
-        trail_attributes['is_backcountry'] = True
-    if '<tag k="gladed" v="yes"/>' in line and not trail_attributes['is_glade']:
-        trail_attributes['difficulty_modifier'] += 1
-        trail_attributes['is_glade'] = True
-    if '<tag k="gladed" v="no"/>' in line:
-        trail_attributes['glade_override'] = True
-    if '<tag k="leaf_type"' in line and not trail_attributes['is_glade']:
-        trail_attributes['difficulty_modifier'] += 1
-        trail_attributes['is_glade'] = True
-    if '<tag k="leaf_type"' in line or '<tag k="area" v="yes"/>' in line:
-        trail_attributes['is_area'] = True
-    if '<tag k="natural" v="wood"/>' in line:
-        trail_attributes['is_area'] = True
-    if 'glade' in line and not trail_attributes['is_glade']:
-        trail_attributes['difficulty_modifier'] += 1
-        trail_attributes['is_glade'] = True
-    if 'Glade' in line and not trail_attributes['is_glade']:
-        trail_attributes['difficulty_modifier'] += 1
-        trail_attributes['is_glade'] = True
-    if '<tag k="aerialway"' in line and not 'v="zip_line"' in line and not 'v="station"' in line and not 'v="goods"' in line:
-        trail_attributes['is_lift'] = True
-    if 'Tree Skiing' in line and not trail_attributes['is_glade']:
-        trail_attributes['difficulty_modifier'] += 1
-        trail_attributes['is_glade'] = True
+    matches = tag_rules['matches']
+    for key, value in tags:
+        if key == 'name':
+            trail_attributes['way_name'] = value
+        actions = matches.get((key, value))
+        if actions is None:
+            actions = match_tag_rules(key, value, tag_rules)
+        for flag, modifier in actions:
+            if not trail_attributes[flag]:
+                trail_attributes[flag] = True
+                trail_attributes['difficulty_modifier'] += modifier
     return trail_attributes
 
 
-def process_osm(lines: List[str], blacklist: str, whitelist_mode: bool = False) -> dict:
+def index_attributes(attribute_list: List[dict]) -> dict:
+    """
+    Indexes trail attributes by way id
+
+    #### Arguments:
+
+    - attribute_list - list of trail attribute dicts created by process_osm
+
+    #### Returns:
+
+    - attributes - dict {way_id: trail_attributes}
+    """
+    return {trail_attributes['way_id']: trail_attributes for trail_attributes in attribute_list}
+
+
+def classify_way(way_id: str, tags: List[Tuple[str, str]], blacklist: List[str], whitelist_mode: bool, tag_rules: dict) -> Union[dict, None]:
+    """
+    Decides whether a way from an osm file is a trail or a lift
+
+    #### Arguments:
+
+    - way_id - id of the way
+    - tags - list of (key, value) tuples
+    - blacklist - list or set of way ids to blacklist
+    - whitelist_mode - whether to invert the blacklist to a whitelist
+    - tag_rules - dict created by compile_tag_rules
+
+    #### Returns:
+
+    - trail_attributes - dict of trail tags
+    - None if the way is not a trail or a lift
+    """
+    # a way without one of these keys can never become a trail or a lift
+    if tag_rules['classifying_keys'] is not None and \
+            tag_rules['classifying_keys'].isdisjoint([key for key, _ in tags]):
+        return None
+    if (way_id not in blacklist) and whitelist_mode:
+        return None
+    if (way_id in blacklist) and not whitelist_mode:
+        return None
+    trail_attributes = {
+        'way_name': '',
+        'way_id': way_id,
+        'is_trail': False,
+        'is_lift': False,
+        'is_glade': False,
+        'is_backcountry': False,
+        'is_area': False,
+        'glade_override': False,
+        'difficulty_modifier': 0
+    }
+    trail_attributes = process_way_tags(tags, trail_attributes, tag_rules)
+    if trail_attributes['glade_override'] and trail_attributes['is_glade']:
+        trail_attributes['difficulty_modifier'] -= 1
+    if trail_attributes['is_trail'] and not trail_attributes['is_backcountry']:
+        return trail_attributes
+    if trail_attributes['is_lift']:
+        return trail_attributes
+    return None
+
+
+def find_element_start(file: BinaryIO, offset: int) -> int:
+    """
+    Finds the first top level element in an osm file at or after an offset
+
+    #### Arguments:
+
+    - file - osm file opened in binary mode
+    - offset - byte offset to start searching from
+
+    #### Returns:
+
+    - position - byte offset of the element, or the end of the file if there
+    are no more elements
+    """
+    file.seek(offset)
+    buffer = b''
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        buffer += chunk
+        element = ELEMENT_PATTERN.search(buffer)
+        if element is not None:
+            return offset + element.start()
+        if not chunk:
+            return offset + len(buffer)
+
+
+def split_osm(filename: str, parts: int) -> List[Tuple[int, int]]:
+    """
+    Splits an osm file into byte ranges that each start at an element
+
+    #### Arguments:
+
+    - filename - path to an osm file
+    - parts - number of ranges to split the file into
+
+    #### Returns:
+
+    - sections - list of (start, stop) byte offsets, in file order
     """
-    Accepts a list of lines from an OSM file and processes them into more useful formats
+    size = getsize(filename)
+    starts = [0]
+    with open(filename, 'rb') as osm_file:
+        for part in range(1, parts):
+            position = find_element_start(osm_file, size * part // parts)
+            if position > starts[-1] and position < size:
+                starts.append(position)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def parse_osm_section(file: Union[str, BinaryIO], blacklist: List[str], whitelist_mode: bool, tag_rules: dict, read_nodes: bool, read_ways: bool, node_filter: Union[np.ndarray, None], start: int = 0, stop: Union[int, None] = None) -> Tuple[Union[tuple, None], list]:
+    """
+    Reads the nodes and the trail and lift ways from part of an osm file
 
     #### Arguments:
 
-    - lines - list of strings
-    - blacklist - list of trails to blacklist
+    - file - path to an osm file or a file opened in binary mode
+    - blacklist - list or set of way ids to blacklist
     - whitelist_mode - whether to invert the blacklist to a whitelist
+    - tag_rules - dict created by compile_tag_rules
+    - read_nodes - whether to read nodes
+    - read_ways - whether to read ways
+    - node_filter - sorted int64 array of node ids to keep, or None to keep
+    every node
+    - start - byte offset of the first element to read (default = 0)
+    - stop - byte offset to stop reading at (default = end of file)
+
+    #### Returns:
+
+    - nodes - (id (int64 array), lat (array), lon (array)), or None if no
+    nodes were read
+    - ways - list of (trail_attributes (dict), node_id_list (list)), in file
+    order
+    """
+    id = []  # for nodes
+    lat = []  # for nodes
+    lon = []  # for nodes
+    ways = []
+    for element_type, element in iter_osm(file, CHUNK_SIZE, read_nodes, read_ways, node_filter, start, stop, tag_rules['classifying_keys']):
+        if element_type == 'nodes':
+            id.append(element[0])
+            lat.append(element[1])
+            lon.append(element[2])
+            continue
+        way_id, tags, node_id_list = element
+        trail_attributes = classify_way(
+            way_id, tags, blacklist, whitelist_mode, tag_rules)
+        if trail_attributes is not None:
+            ways.append((trail_attributes, node_id_list))
+    if len(id) == 0:
+        return (None, ways)
+    return ((np.concatenate(id), np.concatenate(lat), np.concatenate(lon)), ways)
+
+
+def parse_osm_sections(file: Union[str, BinaryIO], blacklist: List[str], whitelist_mode: bool, tag_rules: dict, read_nodes: bool, read_ways: bool, node_filter: Union[np.ndarray, None], workers: int) -> list:
+    """
+    Reads an osm file with parse_osm_section, splitting it between a pool of
+    processes when more than one worker is requested
+
+    #### Arguments:
+
+    - file - path to an osm file or a file opened in binary mode
+    - blacklist - list or set of way ids to blacklist
+    - whitelist_mode - whether to invert the blacklist to a whitelist
+    - tag_rules - dict created by compile_tag_rules
+    - read_nodes - whether to read nodes
+    - read_ways - whether to read ways
+    - node_filter - sorted int64 array of node ids to keep, or None to keep
+    every node
+    - workers - number of processes to use, only used when file is a path
+    to an uncompressed xml file
+
+    #### Returns:
+
+    - sections - list of results from parse_osm_section, in file order
+    """
+    # only plain xml can be split at byte offsets
+    if workers <= 1 or not isinstance(file, str) or not file.endswith('.osm'):
+        return [parse_osm_section(file, blacklist, whitelist_mode, tag_rules,
+                                  read_nodes, read_ways, node_filter)]
+    # several ranges per worker so one slow range does not hold up the pool
+    sections = split_osm(file, workers * SECTIONS_PER_WORKER)
+    parse = partial(parse_osm_section, file, blacklist, whitelist_mode,
+                    tag_rules, read_nodes, read_ways, node_filter)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(parse, *zip(*sections)))
+
+
+def process_osm(file: Union[str, BinaryIO], blacklist: str, whitelist_mode: bool = False, tag_rules: Union[dict, None] = None, referenced_nodes_only: bool = False, workers: int = 1) -> dict:
+    """
+    Accepts an OSM file and processes it into more useful formats
+
+    #### Arguments:
+
+    - file - path to an osm file (xml, compressed xml or pbf) or an xml file
+    opened in binary mode
+    - blacklist - list or set of way ids to blacklist
+    - whitelist_mode - whether to invert the blacklist to a whitelist
+    - tag_rules - dict created by compile_tag_rules (default = rules from
+    tag_rules.csv)
+    - referenced_nodes_only - whether to read the file twice, first for the
+    ways and then for only the nodes those trails and lifts use, instead of
+    keeping every node in the file (default = False)
+    - workers - number of processes to parse the file with, only used when
+    file is a path to an uncompressed xml file (default = 1)
 
     #### Returns:
 
     - parsed_osm - dict {
-        'node_df' (dataframe),
-        'way_df' (dataframe),
-        'lift_df' (dataframe),
-        'useful_info_list' (list(tuple)),
-        'total_trail_count' (int),
-        'name_and_id_list' (list(tuple))
+        'nodes' (dict created by index_nodes),
+        'trail_ways' (dict created by pack_ways),
+        'lift_ways' (dict created by pack_ways),
+        'trail_count' (int),
+        'lift_count' (int),
+        'attribute_list' (list(dict)),
+        'attributes' (dict created by index_attributes)
         }
     """
     DEBUG_TRAILS = False
 
-    way_df = pd.DataFrame()
-    lift_df = pd.DataFrame()
-    id = []  # for node_df
-    lat = []  # for node_df
-    lon = []  # for node_df
-    coordinates = []  # for node_df
+    if tag_rules is None:
+        tag_rules = load_tag_rules()
+    # way id, name and node id list of each trail / lift
+    trails = ([], [], [])
+    lifts = ([], [], [])
+    trail_names = set()
+    lift_names = set()
+    id = []  # for nodes
+    lat = []  # for nodes
+    lon = []  # for nodes
     attribute_list = []
     blank_name_count = 0
     total_trail_count = 0
     total_lift_count = 0
 
-    in_way = False
-
-    for row in lines:
-        row = str(row)
-        # handling nodes
-        if '<node' in row:
-            split_row = row.split('"')
-            for i, word in enumerate(split_row):
-                if ' id=' in word:
-                    id.append(split_row[i+1])
-                if 'lat=' in word:
-                    lat.append(float(split_row[i+1]))
-                if 'lon=' in word:
-                    lon.append(float(split_row[i+1]))
-            coordinates.append((lat[-1], lon[-1]))
-        # start of a way
-        if '<way' in row:
-            in_way = True
-            trail_attributes = {
-                'way_name': '',
-                'way_id': row.split('"')[1],
-                'is_trail': False,
-                'is_lift': False,
-                'is_glade': False,
-                'is_backcountry': False,
-                'is_area': False,
-                'glade_override': False,
-                'difficulty_modifier': 0,
-                'node_id_list': []
-            }
-            if (str(trail_attributes['way_id']) not in blacklist) and whitelist_mode:
-                in_way = False
-            if (str(trail_attributes['way_id']) in blacklist) and not whitelist_mode:
-                in_way = False
-        # handling when inside a way
-        if in_way:
-            if '</way>' in row:
-                if trail_attributes['glade_override'] and trail_attributes['is_glade']:
-                    trail_attributes['difficulty_modifier'] -= 1
-                if trail_attributes['is_trail'] and not trail_attributes['is_backcountry']:
-                    total_trail_count += 1
-                    if DEBUG_TRAILS:
-                        trail_attributes['way_name'] = trail_attributes['way_id']
-                    if trail_attributes['way_name'] == '':
-                        trail_attributes['way_name'] = ' _' + \
-                            str(blank_name_count)
-                        blank_name_count += 1
-                    if trail_attributes['way_name'] in way_df.columns:
-                        trail_attributes['way_name'] = trail_attributes['way_name'] + \
-                            '_' + str(blank_name_count)
-                        blank_name_count += 1
-                    temp_df = pd.DataFrame()
-                    temp_df[trail_attributes['way_name']
-                            ] = trail_attributes['node_id_list']
-                    way_df = pd.concat([way_df, temp_df], axis=1)
-                    attribute_list.append(trail_attributes)
-                if trail_attributes['is_lift']:
-                    total_lift_count += 1
-                    if DEBUG_TRAILS:
-                        trail_attributes['way_name'] = trail_attributes['way_id']
-                    if trail_attributes['way_name'] == '':
-                        trail_attributes['way_name'] = ' _' + \
-                            str(blank_name_count)
-                        blank_name_count += 1
-                    if trail_attributes['way_name'] in lift_df.columns:
-                        trail_attributes['way_name'] = trail_attributes['way_name'] + \
-                            '_' + str(blank_name_count)
-                        blank_name_count += 1
-                    temp_df = pd.DataFrame()
-                    temp_df[trail_attributes['way_name']
-                            ] = trail_attributes['node_id_list']
-                    lift_df = pd.concat([lift_df, temp_df], axis=1)
-                    attribute_list.append(trail_attributes)
-                in_way = False
-            else:
-                trail_attributes = process_way_tags(row, trail_attributes)
-    node_df = pd.DataFrame()
-    node_df['id'] = id
-    node_df['lat'] = lat
-    node_df['lon'] = lon
-    node_df['coordinates'] = coordinates
+    sections = parse_osm_sections(file, blacklist, whitelist_mode, tag_rules,
+                                  not referenced_nodes_only, True, None, workers)
+    for nodes, ways in sections:
+        if nodes is not None:
+            id.append(nodes[0])
+            lat.append(nodes[1])
+            lon.append(nodes[2])
+        # names are made unique in file order, so this has to run after the
+        # sections are put back together
+        for trail_attributes, node_id_list in ways:
+            if trail_attributes['is_trail'] and not trail_attributes['is_backcountry']:
+                total_trail_count += 1
+                if DEBUG_TRAILS:
+                    trail_attributes['way_name'] = trail_attributes['way_id']
+                if trail_attributes['way_name'] == '':
+                    trail_attributes['way_name'] = ' _' + \
+                        str(blank_name_count)
+                    blank_name_count += 1
+                if trail_attributes['way_name'] in trail_names:
+                    trail_attributes['way_name'] = trail_attributes['way_name'] + \
+                        '_' + str(blank_name_count)
+                    blank_name_count += 1
+                trail_names.add(trail_attributes['way_name'])
+                trails[0].append(trail_attributes['way_id'])
+                trails[1].append(trail_attributes['way_name'])
+                trails[2].append(node_id_list)
+                attribute_list.append(trail_attributes)
+            if trail_attributes['is_lift']:
+                total_lift_count += 1
+                if DEBUG_TRAILS:
+                    trail_attributes['way_name'] = trail_attributes['way_id']
+                if trail_attributes['way_name'] == '':
+                    trail_attributes['way_name'] = ' _' + \
+                        str(blank_name_count)
+                    blank_name_count += 1
+                if trail_attributes['way_name'] in lift_names:
+                    trail_attributes['way_name'] = trail_attributes['way_name'] + \
+                        '_' + str(blank_name_count)
+                    blank_name_count += 1
+                lift_names.add(trail_attributes['way_name'])
+                lifts[0].append(trail_attributes['way_id'])
+                lifts[1].append(trail_attributes['way_name'])
+                lifts[2].append(node_id_list)
+                attribute_list.append(trail_attributes)
+    if referenced_nodes_only:
+        referenced = np.unique(np.array(
+            list(map(int, chain(*trails[2], *lifts[2]))), dtype=np.int64))
+        if not isinstance(file, str):
+            file.seek(0)
+        sections = parse_osm_sections(file, blacklist, whitelist_mode,
+                                      tag_rules, True, False, referenced,
+                                      workers)
+        for nodes, _ in sections:
+            if nodes is not None:
+                id.append(nodes[0])
+                lat.append(nodes[1])
+                lon.append(nodes[2])
+    if len(id) == 0:
+        nodes = index_nodes(np.zeros(0, dtype=np.int64),
+                            np.zeros(0), np.zeros(0))
+    else:
+        nodes = index_nodes(np.concatenate(id), np.concatenate(lat),
+                            np.concatenate(lon))
 
     parsed_osm = {
-        'node_df': node_df,
-        'way_df': way_df,
-        'lift_df': lift_df,
+        'nodes': nodes,
+        'trail_ways': pack_ways(*trails, nodes),
+        'lift_ways': pack_ways(*lifts, nodes),
         'trail_count': total_trail_count,
         'lift_count': total_lift_count,
-        'attribute_list': attribute_list
+        'attribute_list': attribute_list,
+        'attributes': index_attributes(attribute_list)
+    }
+
+    return parsed_osm
+
+
+def osm_cache_key(filename: str, blacklist: List[str], whitelist_mode: bool, tag_rules: dict) -> str:
+    """
+    Creates the key a parse cache is stored under. The key changes whenever
+    the osm file, the blacklist, the tag rules or the parser changes.
+
+    #### Arguments:
+
+    - filename - path to an osm file
+    - blacklist - list or set of way ids to blacklist
+    - whitelist_mode - whether to invert the blacklist to a whitelist
+    - tag_rules - dict created by compile_tag_rules
+
+    #### Returns:
+
+    - key - hex digest (str)
+    """
+    file_hash = hashlib.sha256()
+    with open(filename, 'rb') as osm_file:
+        for chunk in iter(lambda: osm_file.read(CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    key = hashlib.sha256()
+    key.update(file_hash.digest())
+    key.update('|'.join(sorted(str(x) for x in blacklist)).encode('utf8'))
+    key.update('{}|{}|{}'.format(whitelist_mode, tag_rules['digest'],
+               PARSER_VERSION).encode('utf8'))
+    return key.hexdigest()
+
+
+def save_parsed_osm(cache_dir: str, key: str, parsed_osm: dict) -> None:
+    """
+    Saves the output of process_osm as a set of .npy files plus a json file
+    for the way names and trail attributes
+
+    #### Arguments:
+
+    - cache_dir - directory to save the cache in
+    - key - key created by osm_cache_key
+    - parsed_osm - dict created by process_osm
+
+    #### Returns:
+
+    - Void
+    """
+    makedirs(cache_dir, exist_ok=True)
+    arrays = {
+        'node_id': parsed_osm['nodes']['id'],
+        'node_lat': parsed_osm['nodes']['lat'],
+        'node_lon': parsed_osm['nodes']['lon']
+    }
+    meta = {
+        'key': key,
+        'trail_count': parsed_osm['trail_count'],
+        'lift_count': parsed_osm['lift_count'],
+        'attribute_list': parsed_osm['attribute_list']
     }
+    for kind in ['trail', 'lift']:
+        ways = parsed_osm['{}_ways'.format(kind)]
+        for column in ['offsets', 'node_ids', 'node_index']:
+            arrays['{}_{}'.format(kind, column)] = ways[column]
+        meta['{}_way_id'.format(kind)] = ways['way_id']
+        meta['{}_name'.format(kind)] = ways['name']
+    # the old meta.json goes first, so a save interrupted while the arrays are
+    # overwritten leaves no cache rather than the old key over mixed arrays
+    if exists('{}/meta.json'.format(cache_dir)):
+        remove('{}/meta.json'.format(cache_dir))
+    for name, array in arrays.items():
+        np.save('{}/{}.npy'.format(cache_dir, name), np.asarray(array))
+    # meta.json is written last so a cache interrupted part way is never read
+    with open('{}/meta.json.tmp'.format(cache_dir), 'w', encoding='utf8') as meta_file:
+        json.dump(meta, meta_file)
+    replace('{}/meta.json.tmp'.format(cache_dir),
+            '{}/meta.json'.format(cache_dir))
 
+
+def load_parsed_osm(cache_dir: str, key: str) -> Union[dict, None]:
+    """
+    Loads a parse cache saved by save_parsed_osm. The arrays are memory
+    mapped rather than read into memory.
+
+    #### Arguments:
+
+    - cache_dir - directory the cache was saved in
+    - key - key created by osm_cache_key
+
+    #### Returns:
+
+    - parsed_osm - dict in the same form process_osm returns
+    - None if there is no cache or it was saved under a different key
+    """
+    if not exists('{}/meta.json'.format(cache_dir)):
+        return None
+    try:
+        with open('{}/meta.json'.format(cache_dir), 'r', encoding='utf8') as meta_file:
+            meta = json.load(meta_file)
+        if meta['key'] != key:
+            return None
+        arrays = {}
+        for name in CACHED_ARRAYS:
+            arrays[name] = np.load(
+                '{}/{}.npy'.format(cache_dir, name), mmap_mode='r')
+        parsed_osm = {
+            'nodes': {
+                'id': arrays['node_id'],
+                'lat': arrays['node_lat'],
+                'lon': arrays['node_lon']
+            },
+            'trail_count': meta['trail_count'],
+            'lift_count': meta['lift_count'],
+            'attribute_list': meta['attribute_list'],
+            'attributes': index_attributes(meta['attribute_list'])
+        }
+        for kind in ['trail', 'lift']:
+            way_ids = meta['{}_way_id'.format(kind)]
+            parsed_osm['{}_ways'.format(kind)] = {
+                'way_id': way_ids,
+                'name': meta['{}_name'.format(kind)],
+                'offsets': arrays['{}_offsets'.format(kind)],
+                'node_ids': arrays['{}_node_ids'.format(kind)],
+                'node_index': arrays['{}_node_index'.format(kind)],
+                'index': {way_id: i for i, way_id in enumerate(way_ids)}
+            }
+    except (OSError, ValueError, KeyError):
+        return None
+    return parsed_osm
+
+
+def load_osm(filename: str, blacklist: List[str], whitelist_mode: bool = False) -> dict:
+    """
+    Returns the parsed contents of an osm file, using the parse cache stored
+    next to it when the file, blacklist, tag rules and parser are unchanged
+
+    #### Arguments:
+
+    - filename - path to an osm file
+    - blacklist - list or set of way ids to blacklist
+    - whitelist_mode - whether to invert the blacklist to a whitelist
+
+    #### Returns:
+
+    - parsed_osm - dict created by process_osm
+    """
+    cache_dir = '{}.parsed'.format(filename)
+    tag_rules = load_tag_rules()
+    key = osm_cache_key(filename, blacklist, whitelist_mode, tag_rules)
+    parsed_osm = load_parsed_osm(cache_dir, key)
+    if parsed_osm is not None:
+        return parsed_osm
+    # the cache only needs the nodes that trails and lifts use, which keeps
+    # large extracts from holding every building and road node in memory
+    if filename.endswith('.osm') and getsize(filename) >= PARALLEL_MIN_SIZE:
+        workers = cpu_count() or 1
+    else:
+        workers = 1
+    parsed_osm = process_osm(filename, blacklist, whitelist_mode, tag_rules,
+                             referenced_nodes_only=True, workers=workers)
+    try:
+        save_parsed_osm(cache_dir, key, parsed_osm)
+    except OSError:
+        print('Unable to save parse cache for {}'.format(filename))
     return parsed_osm
@@ -0,0 +1,267 @@
+import json
+from os import listdir, replace
+from os.path import exists, getmtime
+from typing import Iterable, List, Union
+import pandas as pd
+
+INDEX_FILE = 'cached/resort_index.json'
+CACHE_DIRS = ['cached/trails', 'cached/lifts', 'cached/bounding_boxes']
+
+
+def read_resort(mountain: str) -> dict:
+    """
+    Reads the cached trail list, lift list and bounding box of a processed
+    mountain
+
+    #### Arguments:
+
+    - mountain - name of a ski area / name of an osm file w/o the file extension
+
+    #### Returns:
+
+    - resort - dict {
+        'ways' (set of way ids),
+        'bounding_box' ([min_lat, max_lat, min_lon, max_lon] or None),
+        'modified' (float, last time one of the cache files changed)
+        }
+    """
+    ways = set()
+    for kind in ['trails', 'lifts']:
+        filename = 'cached/{}/{}.csv'.format(kind, mountain)
+        if not exists(filename):
+            continue
+        try:
+            ways.update(str(x) for x in pd.read_csv(filename)['id'])
+        except (KeyError, pd.errors.EmptyDataError):
+            continue
+    bounding_box = None
+    filename = 'cached/bounding_boxes/{}.csv'.format(mountain)
+    if exists(filename):
+        df = pd.read_csv(filename)
+        bounding_box = [df.latitude.min(), df.latitude.max(),
+                        df.longitude.min(), df.longitude.max()]
+    return {
+        'ways': ways,
+        'bounding_box': bounding_box,
+        'modified': get_modified_time(mountain)
+    }
+
+
+def get_modified_time(mountain: str) -> float:
+    """
+    Finds the last time any of the cache files of a mountain changed
+
+    #### Arguments:
+
+    - mountain - name of a ski area / name of an osm file w/o the file extension
+
+    #### Returns:
+
+    - modified - modification time in seconds, 0 if there are no cache files
+    """
+    modified = 0
+    for directory in CACHE_DIRS:
+        filename = '{}/{}.csv'.format(directory, mountain)
+        if exists(filename):
+            modified = max(modified, getmtime(filename))
+    return modified
+
+
+def save_resort_index(resort_index: dict) -> None:
+    """
+    Saves the resort index
+
+    #### Arguments:
+
+    - resort_index - dict created by load_resort_index
+
+    #### Returns:
+
+    - Void
+    """
+    output = {}
+    for mountain, resort in resort_index.items():
+        output[mountain] = {
+            'ways': sorted(resort['ways']),
+            'bounding_box': resort['bounding_box'],
+            'modified': resort['modified']
+        }
+    with open('{}.tmp'.format(INDEX_FILE), 'w', encoding='utf8') as index_file:
+        json.dump(output, index_file)
+    replace('{}.tmp'.format(INDEX_FILE), INDEX_FILE)
+
+
+def load_resort_index() -> dict:
+    """
+    Loads the index of every processed mountain. Mountains whose cache files
+    changed since the index was saved are re-read, so the index is rebuilt
+    from the cached csv files the first time it is used.
+
+    #### Arguments:
+
+    - None
+
+    #### Returns:
+
+    - resort_index - dict {mountain: dict created by read_resort}
+    """
+    resort_index = {}
+    if exists(INDEX_FILE):
+        try:
+            with open(INDEX_FILE, 'r', encoding='utf8') as index_file:
+                resort_index = json.load(index_file)
+        except (OSError, ValueError):
+            resort_index = {}
+    for resort in resort_index.values():
+        resort['ways'] = set(resort['ways'])
+    mountains = set()
+    for directory in CACHE_DIRS:
+        if exists(directory):
+            mountains.update(filename[:-4] for filename in listdir(directory)
+                             if filename.endswith('.csv'))
+    changed = False
+    for mountain in list(resort_index):
+        if mountain not in mountains:
+            del resort_index[mountain]
+            changed = True
+    for mountain in mountains:
+        if mountain not in resort_index or \
+                resort_index[mountain]['modified'] != get_modified_time(mountain):
+            resort_index[mountain] = read_resort(mountain)
+            changed = True
+    if changed:
+        try:
+            save_resort_index(resort_index)
+        except OSError:
+            print('Unable to save {}'.format(INDEX_FILE))
+    return resort_index
+
+
+def update_resort_index(resort_index: dict, mountain: str) -> None:
+    """
+    Re-reads the cache files of a mountain after it has been processed and
+    saves the index
+
+    #### Arguments:
+
+    - resort_index - dict created by load_resort_index
+    - mountain - name of a ski area / name of an osm file w/o the file extension
+
+    #### Returns:
+
+    - Void
+    """
+    resort_index[mountain] = read_resort(mountain)
+    try:
+        save_resort_index(resort_index)
+    except OSError:
+        print('Unable to save {}'.format(INDEX_FILE))
+
+
+def find_overlapping_resorts(resort_index: dict, mountain: str, bounding_box: List[float]) -> List[str]:
+    """
+    Finds the processed mountains whose bounding box overlaps an area
+
+    #### Arguments:
+
+    - resort_index - dict created by load_resort_index
+    - mountain - name of the mountain to leave out
+    - bounding_box - [min_lat, max_lat, min_lon, max_lon]
+
+    #### Returns:
+
+    - mountains - list of mountain names
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box
+    overlapping = []
+    for other, resort in resort_index.items():
+        if other == mountain or resort['bounding_box'] is None:
+            continue
+        other_min_lat, other_max_lat, other_min_lon, other_max_lon = resort['bounding_box']
+        if other_min_lat > max_lat or other_max_lat < min_lat:
+            continue
+        if other_min_lon > max_lon or other_max_lon < min_lon:
+            continue
+        overlapping.append(other)
+    return sorted(overlapping)
+
+
+def find_shared_ways(resort_index: dict, mountain: str, way_ids: Iterable[str], bounding_box: List[float]) -> dict:
+    """
+    Counts the ways of a mountain that already belong to an overlapping
+    processed mountain
+
+    #### Arguments:
+
+    - resort_index - dict created by load_resort_index
+    - mountain - name of the mountain the ways were found for
+    - way_ids - ids of the trails and lifts found for the mountain
+    - bounding_box - [min_lat, max_lat, min_lon, max_lon] of those ways
+
+    #### Returns:
+
+    - shared - dict {mountain name: number of shared ways}
+    """
+    way_ids = set(way_ids)
+    shared = {}
+    for other in find_overlapping_resorts(resort_index, mountain, bounding_box):
+        count = len(way_ids & resort_index[other]['ways'])
+        if count > 0:
+            shared[other] = count
+    return shared
+
+
+def get_blacklist(resort_index: dict, blacklist: str) -> Union[set, None]:
+    """
+    Returns the ids of the trails and lifts that belong to a processed mountain
+
+    #### Arguments:
+
+    - resort_index - dict created by load_resort_index
+    - blacklist - name of a ski area to ignore the trails for
+
+    #### Returns:
+
+    - way_ids - set of way ids
+    - None if the mountain has not been processed
+    """
+    if blacklist not in resort_index:
+        return None
+    return resort_index[blacklist]['ways']
+
+
+def order_by_blacklist(mountains: List[str], blacklists: List[str]) -> List[int]:
+    """
+    Orders a list of mountains so that each one comes after the mountain it
+    blacklists, so a bulk run always uses the trails found in the same run
+
+    #### Arguments:
+
+    - mountains - list of mountain names
+    - blacklists - name of the mountain each one blacklists ('' for none)
+
+    #### Returns:
+
+    - order - list of indexes into mountains, in the order to process them
+    """
+    position = {mountain: i for i, mountain in enumerate(mountains)}
+    order = []
+    state = [0] * len(mountains)  # 0 = not visited, 1 = visiting, 2 = done
+    for start in range(len(mountains)):
+        stack = [start]
+        while stack:
+            i = stack[-1]
+            if state[i] == 2:
+                stack.pop()
+                continue
+            state[i] = 1
+            dependency = position.get(blacklists[i])
+            # a mountain that whitelists itself, or whose blacklist leads
+            # back to it, is not waited on
+            if dependency is not None and state[dependency] == 0:
+                stack.append(dependency)
+                continue
+            state[i] = 2
+            order.append(i)
+            stack.pop()
+    return order
@@ -14,7 +14,8 @@ plt.rcParams.update({'figure.max_open_warning': 0})
 
 def cache_trail_points(filename: str, list_dfs: pd.DataFrame) -> None:
     """
-    Takes a list of trails and saves them to a cache file to prevent unneeded API calls
+    Takes a list of trails and saves them to a cache file to prevent unneeded API calls.
+    Approximate elevations are left blank, so they are fetched again.
 
     #### Arguments:
 
@@ -33,7 +34,8 @@ def cache_trail_points(filename: str, list_dfs: pd.DataFrame) -> None:
         trail['for_display'] = True
         trail['lat'] = entry['points_df'].lat
         trail['lon'] = entry['points_df'].lon
-        trail['elevation'] = entry['points_df'].elevation
+        trail['elevation'] = entry['points_df'].elevation.mask(
+            entry['points_df'].approximate)
         trail['slope'] = entry['points_df'].slope
         trail['trail_id'] = entry['id']
         trail['for_display'] = True
@@ -45,14 +47,16 @@ def cache_trail_points(filename: str, list_dfs: pd.DataFrame) -> None:
             trail['for_display'] = False
             trail['lat'] = entry['area_centerline_df'].lat
             trail['lon'] = entry['area_centerline_df'].lon
-            trail['elevation'] = entry['area_centerline_df'].elevation
+            trail['elevation'] = entry['area_centerline_df'].elevation.mask(
+                entry['area_centerline_df'].approximate)
             trail['slope'] = entry['area_centerline_df'].slope
             trail['trail_id'] = entry['id']
             trail['for_display'] = False
             trail['index'] = trail.index
             output_df = pd.concat([output_df, trail])
-    output_df['lat'] = [round(Decimal(x), 8) for x in output_df.lat]
-    output_df['lon'] = [round(Decimal(x), 8) for x in output_df.lon]
+    output_df['lat'] = helper.coordinate_keys(output_df.lat)
+    output_df['lon'] = helper.coordinate_keys(output_df.lon)
+    output_df = output_df.rename(columns={'lat': 'lat_e8', 'lon': 'lon_e8'})
     output_df['elevation'] = [round(Decimal(x), 2)
                               for x in output_df.elevation]
     output_df['slope'] = [round(Decimal(x), 2) for x in output_df.slope]
@@ -63,7 +67,8 @@ def cache_trail_points(filename: str, list_dfs: pd.DataFrame) -> None:
 
 def cache_lift_points(filename: str, list_dfs: pd.DataFrame) -> None:
     """
-    Takes a list of trails and saves them to a cache file to prevent unneeded API calls
+    Takes a list of trails and saves them to a cache file to prevent unneeded API calls.
+    Approximate elevations are left blank, so they are fetched again.
 
     #### Arguments:
 
@@ -82,14 +87,16 @@ def cache_lift_points(filename: str, list_dfs: pd.DataFrame) -> None:
         lift['for_display'] = True
         lift['lat'] = entry['points_df'].lat
         lift['lon'] = entry['points_df'].lon
-        lift['elevation'] = entry['points_df'].elevation
+        lift['elevation'] = entry['points_df'].elevation.mask(
+            entry['points_df'].approximate)
         lift['slope'] = entry['points_df'].slope
         lift['lift_id'] = entry['id']
         lift['for_display'] = True
         lift['index'] = lift.index
         output_df = pd.concat([output_df, lift])
-    output_df['lat'] = [round(Decimal(x), 8) for x in output_df.lat]
-    output_df['lon'] = [round(Decimal(x), 8) for x in output_df.lon]
+    output_df['lat'] = helper.coordinate_keys(output_df.lat)
+    output_df['lon'] = helper.coordinate_keys(output_df.lon)
+    output_df = output_df.rename(columns={'lat': 'lat_e8', 'lon': 'lon_e8'})
     output_df['elevation'] = [round(Decimal(x), 2)
                               for x in output_df.elevation]
     output_df['slope'] = [round(Decimal(x), 2) for x in output_df.slope]
@@ -181,7 +188,9 @@ def create_map(trails: List[dict], lifts: List[dict], mountain: str, cardinal_di
             'points_df',
             'difficulty_modifier',
             'is_area',
-            'area_centerline_df'
+            'area_centerline_df',
+            'difficulty',
+            'length'
         }
     - lifts - list(dict('name', 'points_df'))
     - mountain - name of mountain and OSM file (minus the extension)
@@ -210,12 +219,8 @@ def create_map(trails: List[dict], lifts: List[dict], mountain: str, cardinal_di
 
     rating_list = []
     for entry in trails:
-        if not entry['is_area']:
-            index = 'points_df'
-        else:
-            index = 'area_centerline_df'
-        rating = helper.rate_trail(entry[index]['difficulty'])
-        if helper.get_trail_length(entry[index].coordinates) > 100:
+        rating = entry['difficulty']
+        if entry['length'] > 100:
             rating_list.append(round((rating * 100), 0))
         color = helper.set_color(rating, entry['difficulty_modifier'])
         rating = round(rating * 100, 1)
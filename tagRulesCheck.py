@@ -0,0 +1,183 @@
+import sys
+import timeit
+from os import listdir
+from typing import List, Tuple
+
+import osmHelper
+
+
+def legacy_way_tags(line: str, trail_attributes: dict) -> dict:
+    """
+    The if-chain process_way_tags used before tag_rules.csv, kept to check
+    the rules against. Only the flags and the difficulty modifier are set.
+
+    #### Arguments:
+
+    - line - one line of a way from an osm file
+    - trail_attributes - dict of trail tags
+
+    #### Returns:
+
+    - trail_attributes - dict of trail tags
+    """
+    if '<tag k="piste:difficulty"' in line:
+        trail_attributes['is_trail'] = True
+    if '<tag k="piste:type"' in line and 'downhill' in line:
+        trail_attributes['is_trail'] = True
+    if '<tag k="piste:type"' in line and 'backcountry' in line:
+        trail_attributes['is_backcountry'] = True
+    if '<tag k="piste:type"' in line and 'nordic' in line:
+        trail_attributes['is_backcountry'] = True
+    if '<tag k="piste:type"' in line and 'skitour' in line:
+        trail_attributes['is_backcountry'] = True
+    if '<tag k="landuse" v="grass"/>' in line:
+        trail_attributes['is_backcountry'] = True
+    if '<tag k="natural" v="grassland"/>' in line:
+        trail_attributes['is_backcountry'] = True
+    if '<tag k="piste:grooming" v="classic+skating"/>' in line:
+        trail_attributes['is_backcountry'] = True
+    if '<tag k="piste:type" v="hike"/>' in line:
+        trail_attributes['is_backcountry'] = True
+    if '<tag k="mtb:scale:imba"' in line:
+        trail_attributes['is_backcountry'] = True
+    if '<tag k="gladed" v="yes"/>' in line and not trail_attributes['is_glade']:
+        trail_attributes['difficulty_modifier'] += 1
+        trail_attributes['is_glade'] = True
+    if '<tag k="gladed" v="no"/>' in line:
+        trail_attributes['glade_override'] = True
+    if '<tag k="leaf_type"' in line and not trail_attributes['is_glade']:
+        trail_attributes['difficulty_modifier'] += 1
+        trail_attributes['is_glade'] = True
+    if '<tag k="leaf_type"' in line or '<tag k="area" v="yes"/>' in line:
+        trail_attributes['is_area'] = True
+    if '<tag k="natural" v="wood"/>' in line:
+        trail_attributes['is_area'] = True
+    if 'glade' in line and not trail_attributes['is_glade']:
+        trail_attributes['difficulty_modifier'] += 1
+        trail_attributes['is_glade'] = True
+    if 'Glade' in line and not trail_attributes['is_glade']:
+        trail_attributes['difficulty_modifier'] += 1
+        trail_attributes['is_glade'] = True
+    if '<tag k="aerialway"' in line and not 'v="zip_line"' in line and not 'v="station"' in line and not 'v="goods"' in line:
+        trail_attributes['is_lift'] = True
+    if 'Tree Skiing' in line and not trail_attributes['is_glade']:
+        trail_attributes['difficulty_modifier'] += 1
+        trail_attributes['is_glade'] = True
+    return trail_attributes
+
+
+def blank_attributes() -> dict:
+    """
+    Creates the trail attributes a way starts with
+
+    #### Arguments:
+
+    - None
+
+    #### Returns:
+
+    - trail_attributes - dict of trail tags
+    """
+    attributes = {'difficulty_modifier': 0}
+    for flag in osmHelper.TAG_FLAGS:
+        attributes[flag] = False
+    return attributes
+
+
+def read_ways(filename: str) -> Tuple[List[List[str]], List[List[tuple]]]:
+    """
+    Reads every way in an osm file both ways it has been parsed: as the tag
+    lines the if-chain was given, and as the (key, value) tuples the rules
+    are given
+
+    #### Arguments:
+
+    - filename - path to an xml osm file
+
+    #### Returns:
+
+    - line_lists - list of lists of lines, one for each way
+    - tag_lists - list of lists of (key, value) tuples, in the same order
+    """
+    line_lists = []
+    in_way = False
+    with open(filename, 'r', encoding='utf8') as osm_file:
+        for line in osm_file:
+            # the if-chain was given every line of a way but the last
+            if '<way' in line:
+                in_way = True
+                line_lists.append([])
+            if not in_way:
+                continue
+            if '</way>' in line:
+                in_way = False
+            else:
+                line_lists[-1].append(line)
+            if line.rstrip().endswith('/>') and '<way' in line:
+                in_way = False
+    tag_lists = [way[1][1] for way in osmHelper.iter_osm(
+        filename, read_nodes=False)]
+    return (line_lists, tag_lists)
+
+
+def check_tag_rules(osm_dir: str = 'osm', repeat: int = 5) -> int:
+    """
+    Classifies every way in the xml osm files with both the if-chain and the
+    tag rules, prints the ways that differ, and times both
+
+    #### Arguments:
+
+    - osm_dir - directory of osm files (default = 'osm')
+    - repeat - number of times each is timed, the fastest is printed
+    (default = 5)
+
+    #### Returns:
+
+    - mismatches - number of ways classified differently
+    """
+    tag_rules = osmHelper.load_tag_rules()
+    line_lists = []
+    tag_lists = []
+    for filename in sorted(listdir(osm_dir)):
+        if not filename.endswith('.osm'):
+            continue
+        lines, tags = read_ways('{}/{}'.format(osm_dir, filename))
+        if len(lines) != len(tags):
+            print('{}: {} ways read line by line, {} by iter_osm'.format(
+                filename, len(lines), len(tags)))
+            return -1
+        line_lists += lines
+        tag_lists += tags
+
+    def run_legacy():
+        results = []
+        for lines in line_lists:
+            trail_attributes = blank_attributes()
+            for line in lines:
+                legacy_way_tags(line, trail_attributes)
+            results.append(trail_attributes)
+        return results
+
+    def run_rules():
+        return [osmHelper.process_way_tags(tags, blank_attributes(), tag_rules)
+                for tags in tag_lists]
+
+    mismatches = 0
+    for lines, tags, before, after in zip(line_lists, tag_lists, run_legacy(), run_rules()):
+        after.pop('way_name', None)
+        if before != after:
+            mismatches += 1
+            print('Mismatch: {}\n  if-chain: {}\n  rules:    {}'.format(
+                tags, before, after))
+    print('ways: {}, tags: {}, mismatches: {}'.format(
+        len(tag_lists), sum(len(tags) for tags in tag_lists), mismatches))
+    print('tag values remembered: {}'.format(len(tag_rules['matches'])))
+    print('if-chain: {:.3f} s, rules: {:.3f} s'.format(
+        min(timeit.repeat(run_legacy, number=1, repeat=repeat)),
+        min(timeit.repeat(run_rules, number=1, repeat=repeat))))
+    return mismatches
+
+
+if __name__ == "__main__":
+    if check_tag_rules() != 0:
+        sys.exit(1)